@@ -407,12 +407,14 @@ print(actor_dict)
 face_app = FaceAnalysis(
     name="auraface",
     root="models",
-    providers=["CPUExecutionProvider"]
+    providers=["CPUExecutionProvider"],
+    allowed_modules=["detection", "recognition"] # only boxes and embeddings are used
 )
 face_app.prepare(ctx_id=0) # use cpu
 
 X = []
 y = []
+group_shots = [] # (role, embeddings of every face) for images with several faces
 
 data_dir = "./faces"  # folder structure: ./faces/person1/*.jpg
 
@@ -446,11 +448,45 @@ for actor_name, role in actor_dict.items():
         # use face analysis to get the face embedding
         faces = face_app.get(img)
 
-        # only keep images with exactly one face
+        # images with exactly one face are kept as they are
         if len(faces) == 1:
             embedding = faces[0].normed_embedding
             X.append(embedding)
             y.append(role)
+        # group shots are sorted out once every single face has been seen
+        elif len(faces) > 1:
+            group_shots.append((role, np.array([f.normed_embedding for f in faces])))
+
+
+# ### Pick the right face out of group shots
+
+# In[ ]:
+
+
+# each character's "prototype" is the average of their single-face embeddings.
+# in a group shot, the face most similar to that prototype is the character,
+# as long as it's similar enough and clearly ahead of the other faces in it
+MIN_SIMILARITY = 0.3
+MIN_MARGIN = 0.1
+
+X_single, y_single = np.array(X), np.array(y)
+prototypes = {}
+for role in set(y):
+    mean = X_single[y_single == role].mean(axis=0)
+    prototypes[role] = mean / np.linalg.norm(mean)
+
+picked = 0
+for role, embeddings in group_shots:
+    if role not in prototypes:
+        continue
+    sims = embeddings @ prototypes[role] # cosine similarity of every face at once
+    best, runner_up = np.argsort(-sims)[:2]
+    if sims[best] >= MIN_SIMILARITY and sims[best] - sims[runner_up] >= MIN_MARGIN:
+        X.append(embeddings[best])
+        y.append(role)
+        picked += 1
+
+print(f"kept {picked} of {len(group_shots)} group shots")
 
 
 # ### Train a classifier
@@ -250,7 +250,7 @@ export default function App() {
       const r = await fetch(`${API}/api/scrape`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ movieTitle: movie?.title || "", actorDict: cast }),
+        body: JSON.stringify({ movieTitle: movie?.title || "", movieId: movie?.id, actorDict: cast }),
       });
       setScrapeStatus(JSON.stringify(await r.json(), null, 2));
     } catch (e) {
@@ -258,12 +258,33 @@ export default function App() {
     }
   }
 
+  // every movie gets its own faces + model on the ML side
+  function movieQuery() {
+    return movie?.id ? `movie_id=${encodeURIComponent(movie.id)}` : "";
+  }
+
   // train model
   async function train() {
     try {
       setTrainStatus("training...");
-      const r = await fetch(`${API}/api/train`, { method: "POST" });
-      setTrainStatus(JSON.stringify(await r.json(), null, 2));
+      const r = await fetch(`${API}/api/train?${movieQuery()}`, { method: "POST" });
+      const started = await r.json();
+      if (!started.job_id) return setTrainStatus(JSON.stringify(started, null, 2));
+
+      // training runs in the background, poll the job until it finishes
+      while (true) {
+        const j = await (await fetch(`${API}/api/jobs/${started.job_id}`)).json();
+        if (!["queued", "running"].includes(j.status)) {
+          setTrainStatus(JSON.stringify(j.result || j, null, 2));
+          break;
+        }
+        const p = j.progress || {};
+        setTrainStatus(p.stage === "embedding"
+          ? `training... ${p.images_done}/${p.images_total} images, ${p.faces_kept} faces kept` +
+            (p.eta_seconds != null ? `, ~${Math.ceil(p.eta_seconds)}s left` : "")
+          : `training... ${p.stage || j.status}`);
+        await new Promise(done => setTimeout(done, 1000));
+      }
     } catch (e) {
       setTrainStatus(`Error: ${e?.message || String(e)}`);
     }
@@ -283,7 +304,7 @@ export default function App() {
     const fd = new FormData();
     fd.append("image", file);
     // make prediction
-    const r = await fetch(`${API}/api/predict`, { method: "POST", body: fd });
+    const r = await fetch(`${API}/api/predict?${movieQuery()}`, { method: "POST", body: fd });
     const j = await r.json();
     setPred(j);
   }
@@ -1,69 +1,558 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from insightface.app import FaceAnalysis
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
+from typing import List, Optional
 import numpy as np
-import cv2, os, joblib
+import asyncio, os, joblib, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from embed_cache import EMBED_DIM, EmbeddingCache, content_key
+from assign import assign_faces, role_prototypes
+import face_pipeline
+from face_pipeline import MODEL_NAME
+from downscale import Upload, detect_and_align_uploads
+from gallery import EmbeddingIndex
+from image_filter import dedup_embeddings, filter_images, inspect_file
+from registry import ModelRegistry
+from scrape import scrape_cast
+from ingest import ingest
+from jobs import JobManager
+from parallel_embed import detect_file, detect_files_parallel, default_workers
+from inference import InferencePool, Saturated, TimedOut
+from profiles import PREDICT_PROFILE, TRAIN_PROFILE, get_profile, profile_tag
+from batching import MicroBatcher
+from result_cache import ResultCache
+from tmdb import TMDB_URL, Offline, Tmdb
+import httpx
+import metrics
+from metrics import FACES_PER_IMAGE, IMAGES_REJECTED, timed
 
-app = FastAPI()
 DATA_DIR = os.path.join(os.path.dirname(__file__), "faces")
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "clf.joblib")
+CACHE_DIR = os.environ.get("CACHE_DIR") or os.path.join(os.path.dirname(__file__), "models", "embeddings")
+MODEL_CACHE_MB = int(os.environ.get("MODEL_CACHE_MB", "512"))
+# RESULT_CACHE_SIZE / RESULT_CACHE_DIR: /predict answers kept in memory (1024) / on disk (off)
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+# TMDB_CACHE: TMDB answers, the only source with TMDB_OFFLINE=1 (models/tmdb.sqlite)
+TMDB_CACHE = os.environ.get("TMDB_CACHE") or os.path.join(os.path.dirname(__file__), "models", "tmdb.sqlite")
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "0")) or default_workers()
+PARALLEL_MIN_IMAGES = 32  # below this, starting worker processes costs more than it saves
+INFER_WORKERS = int(os.environ.get("INFER_WORKERS", "2"))
+INFER_QUEUE = int(os.environ.get("INFER_QUEUE", "16"))
+INFER_TIMEOUT = float(os.environ.get("INFER_TIMEOUT", "30"))
+# BATCH_MAX_FACES / BATCH_MAX_WAIT_MS: when a shared recognition batch of at most INFER_WORKERS requests closes (32 / 5)
+BATCH_MAX_FACES = int(os.environ.get("BATCH_MAX_FACES", "32"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+# STORE_DTYPE: precision of the stored training embeddings (float16)
+STORE_DTYPE = os.environ.get("STORE_DTYPE", "float16")
+# ASSIGN_MIN_SIMILARITY / ASSIGN_MIN_MARGIN: when a group shot's best face is kept for its role (0.3 / 0.1)
+ASSIGN_MIN_SIMILARITY = float(os.environ.get("ASSIGN_MIN_SIMILARITY", "0.3"))
+ASSIGN_MIN_MARGIN = float(os.environ.get("ASSIGN_MIN_MARGIN", "0.1"))
+# DEDUP_HASH_DISTANCE / DEDUP_COSINE: when two training images / two faces of a role count as one (6 bits / 0.97)
+DEDUP_HASH_DISTANCE = int(os.environ.get("DEDUP_HASH_DISTANCE", "6"))
+DEDUP_COSINE = float(os.environ.get("DEDUP_COSINE", "0.97"))
+# WARM_UP: load and warm the models in the background at startup (1)
+WARM_UP = os.environ.get("WARM_UP", "1") != "0"
 os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
 
-face_app = FaceAnalysis(name="auraface", root="models", providers=["CPUExecutionProvider"])
-face_app.prepare(ctx_id=0)  # CPU
-
-clf = None
-labels = None
-
-def load_embeddings_from_faces():
-  X, y = [], []
-  if not os.path.exists(DATA_DIR):
-    return np.array([]), np.array([])
-  for role in os.listdir(DATA_DIR):
-    role_dir = os.path.join(DATA_DIR, role)
-    if not os.path.isdir(role_dir): continue
-    for fn in os.listdir(role_dir):
-      if not fn.lower().endswith((".jpg",".jpeg",".png")): continue
-      img = cv2.imread(os.path.join(role_dir, fn))
-      if img is None: continue
-      faces = face_app.get(img)
-      if len(faces) == 1:
-        X.append(faces[0].normed_embedding)
-        y.append(role)
-  return np.array(X), np.array(y)
+# embeddings are content addressed, so one cache is shared by every movie.
+# it is kept per training profile since that decides which faces are found
+embed_cache = EmbeddingCache(CACHE_DIR, f"{MODEL_NAME}-{profile_tag(TRAIN_PROFILE)}")
+registry = ModelRegistry(os.path.dirname(__file__), MODEL_CACHE_MB * 2**20)
+predictions = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_DIR)
+tmdb = Tmdb(os.environ.get("TMDB_API_KEY", ""), TMDB_CACHE, os.environ.get("TMDB_URL", TMDB_URL),
+            offline=os.environ.get("TMDB_OFFLINE", "0") == "1")
+jobs = JobManager()
+infer = InferencePool(INFER_WORKERS, INFER_QUEUE, INFER_TIMEOUT, PREDICT_PROFILE)
+face_pipeline.shared_threads = infer.threads
+batcher = MicroBatcher(BATCH_MAX_FACES, BATCH_MAX_WAIT_MS / 1000, lambda: infer.running)
 
+metrics.Gauge("face_id_inference_pending", "predict calls queued or running on the inference pool", lambda: infer.pending)
+metrics.Gauge("face_id_batcher_queue", "requests waiting for the next recognition pass", lambda: batcher.queue.qsize())
+metrics.Gauge("face_id_jobs_active", "train jobs queued or running", lambda: sum(j.finished is None for j in list(jobs.jobs.values())))
+metrics.Gauge("face_id_models_loaded", "per-movie models held in memory", lambda: len(registry.loaded()))
+RESULT_CACHE = metrics.Counter("face_id_result_cache_total", "predict result cache lookups by outcome")
+REQUEST_SECONDS = metrics.Histogram("face_id_request_seconds", "request latency by route and status",
+                                    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30])
+
+readiness = {"status": "starting", "error": None, "seconds": None}
+
+# builds the shared FaceAnalysis (used by training and the micro-batcher) and
+# every inference worker's detector, each with one dummy pass, off the startup path
+def warm_up_models():
+  started = time.time()
+  try:
+    face_pipeline.warm_up(face_pipeline.shared_app())
+    for fut in infer.warm():
+      fut.result()
+    readiness["status"] = "ready"
+  except Exception as e:
+    readiness["status"], readiness["error"] = "failed", f"{type(e).__name__}: {e}"
+  readiness["seconds"] = round(time.time() - started, 2)
+
+@asynccontextmanager
+async def lifespan(app):
+  if WARM_UP:
+    threading.Thread(target=warm_up_models, name="warm-up", daemon=True).start()
+  else:
+    readiness["status"] = "lazy"
+  yield
+  await tmdb.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+  t = time.perf_counter()
+  response = await call_next(request)
+  route = request.scope.get("route")
+  REQUEST_SECONDS.observe(time.perf_counter() - t, path=route.path if route else "unmatched",
+                          status=response.status_code)
+  return response
+
+@app.get("/metrics")
+def get_metrics():
+  return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# 503 until the models are loaded and warmed, so a load balancer or the
+# gateway can hold traffic back. with WARM_UP=0 this reports ready at once
+@app.get("/ready")
+def ready():
+  ok = readiness["status"] in ("ready", "lazy")
+  return JSONResponse({"ok": ok, **readiness}, status_code=200 if ok else 503)
+
+@app.exception_handler(Saturated)
+async def saturated(request, exc):
+  return JSONResponse({"ok": False, "msg": "too many requests in flight, try again shortly"},
+                      status_code=429, headers={"Retry-After": "1"})
+
+@app.exception_handler(TimedOut)
+async def timed_out(request, exc):
+  return JSONResponse({"ok": False, "msg": "inference timed out"}, status_code=504)
+
+# a TMDB lookup's answer, or why there is none: 503 when offline with nothing
+# cached, 502 when TMDB fails and nothing is cached (its own status only goes
+# in the message, a 401 for a bad key is not this service's 401)
+async def tmdb_answer(lookup):
+  try:
+    return await lookup
+  except Offline as e:
+    return JSONResponse({"ok": False, "msg": f"offline and not cached: {e}"}, status_code=503)
+  except httpx.HTTPStatusError as e:
+    return JSONResponse({"ok": False, "msg": f"TMDB answered {e.response.status_code}"}, status_code=502)
+  except (httpx.HTTPError, ValueError):
+    return JSONResponse({"ok": False, "msg": "TMDB unreachable and not cached"}, status_code=502)
+
+# movie search and cast selection for the gateway, answered from the local
+# TMDB cache after the first lookup. api_key falls back to TMDB_API_KEY
+@app.get("/tmdb/search")
+async def search_movies(q: str = "", api_key: str = ""):
+  if not q.strip():
+    return []
+  return await tmdb_answer(tmdb.search(q, api_key or None))
+
+@app.get("/tmdb/credits/{movie_id}")
+async def movie_credits(movie_id: int, api_key: str = ""):
+  return await tmdb_answer(tmdb.cast(movie_id, api_key or None))
+
+class ScrapeRequest(BaseModel):
+  actorDict: dict
+  movieTitle: str = ""
+  movieId: Optional[int] = None
+  apiKey: str = ""
+  limit: int = 40
+
+# downloads every role's search images concurrently into the movie's faces folder
+@app.post("/scrape")
+async def scrape(req: ScrapeRequest):
+  api_key = req.apiKey or os.environ.get("SERPAPI_KEY", "")
+  results = await scrape_cast(req.actorDict, req.movieTitle, registry.faces_dir(req.movieId), api_key, req.limit)
+  return {"ok": True, "results": results}
+
+# embeddings of every face in each file, detection only runs on cache misses.
+# enough misses at once and they are spread over a pool of worker processes.
+# returns (embeddings, boxes, scores) per file, and progress(embeddings) is
+# called once per file as it completes
+def embed_files(paths, progress=None):
+  out, misses = [None] * len(paths), []
+  for i, path in enumerate(paths):
+    with open(path, "rb") as fh:
+      key = content_key(fh.read())
+    hit = embed_cache.get(key)
+    if hit is not None:
+      out[i] = hit
+      if progress: progress(hit[0])
+    else:
+      misses.append((i, path, key))
+  if len(misses) >= PARALLEL_MIN_IMAGES and EMBED_WORKERS > 1:
+    found = detect_files_parallel([p for _, p, _ in misses], MODEL_NAME,
+                                  workers=EMBED_WORKERS, profile=TRAIN_PROFILE)
+  else:
+    found = (detect_file(face_pipeline.shared_app(), p) for _, p, _ in misses)
+  for (i, _, key), (embeddings, boxes, scores) in zip(misses, found):
+    embed_cache.put(key, embeddings, boxes, scores)
+    out[i] = embeddings, boxes, scores
+    if progress: progress(embeddings)
+  return out
+
+def embed_file(path):
+  return embed_files([path])[0][0]
+
+# what ingest embeds as images land: None for junk (see image_filter.inspect),
+# which training would drop anyway. duplicates can only be told apart once the
+# whole folder is there, so those are left for training to skip
+def embed_unless_junk(path):
+  reason, _ = inspect_file(path)
+  return None if reason else embed_file(path)
+
+class IngestRequest(ScrapeRequest):
+  workers: int = 2
+
+# scrape with embedding overlapped on the downloads, then queue a train on the
+# (now cached) faces like /train does, so it never runs alongside another train.
+# returns once the scrape is done, poll GET /jobs/{job_id} for the train
+@app.post("/ingest")
+async def ingest_and_train(req: IngestRequest):
+  api_key = req.apiKey or os.environ.get("SERPAPI_KEY", "")
+  scraped, embedded = await ingest(req.actorDict, req.movieTitle, registry.faces_dir(req.movieId),
+                                   api_key, embed_unless_junk, req.workers, req.limit)
+  job = jobs.submit("train", run_train, movie_id=req.movieId)
+  return {"ok": True, "results": scraped, "embedded": embedded, "job_id": job.id, "status": job.status}
+
+# junk and near-duplicate images are dropped before anything is embedded, and
+# faces of one role that came out as nearly the same embedding after it.
+# returns the training faces as columns, the layout EmbeddingStore saves:
+# X, y (role), path (relative to data_dir), box, score and confidence, which
+# is 1 for single-face images and the similarity to the role's prototype for
+# faces picked out of a group shot (see assign.py)
+def load_embeddings_from_faces(roles=None, data_dir=DATA_DIR, progress=None):
+  rows, paths, roles_of = [], [], []
+  groups, group_rows = [], []
+  rejected = {}
+  with timed("train_filter"):
+    names = roles if roles is not None else os.listdir(data_dir) if os.path.isdir(data_dir) else []
+    for role in names:
+      role_dir = os.path.join(data_dir, role)
+      if not os.path.isdir(role_dir): continue
+      files = [os.path.join(role_dir, fn) for fn in sorted(os.listdir(role_dir))
+               if fn.lower().endswith((".jpg",".jpeg",".png"))]
+      kept, dropped = filter_images(files, DEDUP_HASH_DISTANCE)
+      paths.extend(kept)
+      roles_of.extend([role] * len(kept))
+      rejected.update(dropped)
+  for reason in rejected.values():
+    IMAGES_REJECTED.inc(reason=reason)
+  if progress: progress.start(len(paths), rejected)
+  with timed("train_embed"):
+    for role, path, (embeddings, boxes, scores) in zip(roles_of, paths, embed_files(paths, progress)):
+      FACES_PER_IMAGE.observe(len(embeddings), source="train")
+      path = os.path.relpath(path, data_dir)
+      if len(embeddings) == 1:
+        rows.append((embeddings[0], role, path, boxes[0], scores[0]))
+      elif len(embeddings) == 0:
+        IMAGES_REJECTED.inc(reason="no_face")
+      else:
+        groups.append(embeddings)
+        group_rows.append((role, path, boxes, scores))
+  X = np.array([r[0] for r in rows], np.float32).reshape(-1, EMBED_DIM)
+  y = np.array([r[1] for r in rows], str)
+  with timed("train_assign"):
+    picks, sims = assign_faces(groups, [r[0] for r in group_rows], role_prototypes(X, y),
+                               ASSIGN_MIN_SIMILARITY, ASSIGN_MIN_MARGIN)
+  chosen = np.flatnonzero(picks >= 0)
+  if len(picks) > len(chosen):
+    IMAGES_REJECTED.inc(len(picks) - len(chosen), reason="multi_face")
+  for i in chosen:
+    role, path, boxes, scores = group_rows[i]
+    rows.append((groups[i][picks[i]], role, path, boxes[picks[i]], scores[picks[i]]))
+  if progress: progress.assigned(len(chosen))
+  faces = {"X": np.array([r[0] for r in rows], np.float32).reshape(-1, EMBED_DIM),
+           "y": np.array([r[1] for r in rows], str),
+           "path": np.array([r[2] for r in rows], str),
+           "box": np.array([r[3] for r in rows], np.float32).reshape(-1, 4),
+           "score": np.array([r[4] for r in rows], np.float32),
+           "confidence": np.r_[np.ones(len(X), np.float32), sims[chosen]].astype(np.float32)}
+  keep = np.zeros(len(rows), bool)
+  for role in np.unique(faces["y"]):
+    at = np.flatnonzero(faces["y"] == role)
+    keep[at] = dedup_embeddings(faces["X"][at], DEDUP_COSINE)
+  if not keep.all():
+    IMAGES_REJECTED.inc(int((~keep).sum()), reason="similar_face")
+  if progress: progress.similar(int((~keep).sum()))
+  return {k: v[keep] for k, v in faces.items()}
+
+# start from the previous model: known classes keep their weights, new ones
+# start along their mean embedding so lbfgs only has a little work left
+def warm_start_classifier(prev, X, y):
+  from sklearn.linear_model import LogisticRegression
+  new = LogisticRegression(max_iter=1000, warm_start=True)
+  classes = np.unique(y)
+  if prev is None or len(prev.classes_) <= 2 or len(classes) <= 2:
+    return new
+  known = {c: i for i, c in enumerate(prev.classes_)}
+  scale = float(np.linalg.norm(prev.coef_, axis=1).mean())
+  coef = np.zeros((len(classes), X.shape[1]))
+  intercept = np.zeros(len(classes))
+  for i, c in enumerate(classes):
+    if c in known:
+      coef[i] = prev.coef_[known[c]]
+      intercept[i] = prev.intercept_[known[c]]
+    else:
+      proto = X[y == c].mean(axis=0)
+      coef[i] = proto / (np.linalg.norm(proto) + 1e-12) * scale
+  new.coef_, new.intercept_ = coef, intercept
+  return new
+
+BACKENDS = ("logreg", "index")
+
+def backend_of(model):
+  return "index" if isinstance(model, EmbeddingIndex) else "logreg"
+
+TRAIN_MODES = ("full", "incremental")
+
+# job progress for the embedding stage: images done, faces kept, images
+# rejected for having no face or several, and an ETA from the rate so far
+class EmbeddingProgress:
+  def __init__(self, job):
+    self.job = job
+
+  # total is what is left to embed once `filtered` ({path: reason}) is set aside
+  def start(self, total, filtered=None):
+    self.total, self.started = total, time.time()
+    self.counts = {"images_done": 0, "faces_kept": 0, "rejected_no_face": 0, "rejected_multi_face": 0}
+    reasons = list((filtered or {}).values())
+    self.job.update(stage="embedding", images_total=total, **self.counts,
+                    rejected_duplicate=reasons.count("duplicate"),
+                    rejected_junk=len(reasons) - reasons.count("duplicate"))
+
+  # group shots whose role's face could be picked out after all
+  def assigned(self, n):
+    self.counts["rejected_multi_face"] -= n
+    self.counts["faces_kept"] += n
+    self.job.update(faces_assigned=n, **self.counts)
+
+  # faces dropped after embedding as near copies of another face of their role
+  def similar(self, n):
+    self.counts["faces_kept"] -= n
+    self.job.update(faces_kept=self.counts["faces_kept"], rejected_similar_face=n)
+
+  def __call__(self, embeddings):
+    n = len(embeddings)
+    self.counts["images_done"] += 1
+    self.counts["faces_kept" if n == 1 else "rejected_no_face" if n == 0 else "rejected_multi_face"] += 1
+    done = self.counts["images_done"]
+    eta = (time.time() - self.started) / done * (self.total - done)
+    self.job.update(eta_seconds=round(eta, 1), **self.counts)
+
+# returns a job id straight away, poll GET /jobs/{id} for progress and the result.
+# backend=index swaps the classifier for a cosine nearest-neighbour gallery that
+# answers "unknown" below its (calibrated or given) similarity threshold.
+# movie_id (TMDB id) selects movies/<id>/faces and its own model file
 @app.post("/train")
-def train():
-  global clf, labels
-  X, y = load_embeddings_from_faces()
-  if len(X) < 2:
+def train(mode: str = "full", roles: str = "", backend: str = None, threshold: float = None, movie_id: int = None):
+  if mode not in TRAIN_MODES:
+    return {"ok": False, "msg": f"unknown train mode '{mode}'"}
+  if backend is not None and backend not in BACKENDS:
+    return {"ok": False, "msg": f"unknown backend '{backend}'"}
+  job = jobs.submit("train", run_train, mode, roles, backend, threshold, movie_id)
+  return {"ok": True, "job_id": job.id, "status": job.status}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+  job = jobs.get(job_id)
+  if job is None:
+    return JSONResponse({"ok": False, "msg": "no such job"}, status_code=404)
+  return {"ok": True, **job.to_dict()}
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+  job = jobs.cancel(job_id)
+  if job is None:
+    return JSONResponse({"ok": False, "msg": "no such job"}, status_code=404)
+  return {"ok": True, **job.to_dict()}
+
+# the training faces a movie's model was last trained on, the store generation
+# its model file names. None if there are none
+def saved_faces(movie_id, prev):
+  return registry.store(movie_id).open(prev["store"]) if "store" in prev else None
+
+def run_train(job, mode="full", roles="", backend=None, threshold=None, movie_id=None):
+  progress = EmbeddingProgress(job) if job is not None else None
+  data_dir, model_path = registry.faces_dir(movie_id), registry.model_path(movie_id)
+  # a retrain of any mode keeps the backend and threshold the model was asked
+  # for unless the request names its own
+  prev = joblib.load(model_path) if os.path.exists(model_path) else {}
+  saved = saved_faces(movie_id, prev) if mode == "incremental" and prev else None
+  backend = backend or prev.get("backend") or backend_of(prev.get("clf"))
+  threshold = threshold if threshold is not None else prev.get("threshold")
+  if backend not in BACKENDS:
+    return {"ok": False, "msg": f"unknown backend '{backend}'"}
+  if mode == "incremental" and saved is not None:
+    roles = [r.strip() for r in roles.split(",") if r.strip()]
+    if not roles:
+      return {"ok": False, "msg": "incremental training needs roles"}
+    # re-embed only the named roles, everything else comes from the saved store
+    new = load_embeddings_from_faces(roles, data_dir, progress)
+    keep = ~np.isin(saved["y"], roles)
+    faces = {k: np.concatenate([saved[k][keep], new[k]]) for k in new}
+  elif mode in ("full", "incremental"):
+    # nothing saved to build on yet, so incremental falls back to a full train
+    mode = "full"
+    faces = load_embeddings_from_faces(data_dir=data_dir, progress=progress)
+  else:
+    return {"ok": False, "msg": f"unknown train mode '{mode}'"}
+  if len(faces["y"]) < 2:
     return {"ok": False, "msg": "not enough data to train"}
-  X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.05, random_state=42)
-  clf = LogisticRegression(max_iter=1000).fit(X_train, y_train)
+  if job is not None: job.update(stage="fitting", eta_seconds=None)
+  # training-only dependencies, imported on the first train rather than at startup
+  from sklearn.linear_model import LogisticRegression
+  from sklearn.model_selection import train_test_split
+  train_rows, test_rows = train_test_split(np.arange(len(faces["y"])), test_size=0.05, random_state=42)
+  # stored train rows first, so an index backend's gallery is a prefix of the store
+  faces = {k: v[np.r_[train_rows, test_rows]] for k, v in faces.items()}
+  X, y, n = faces["X"], faces["y"], len(train_rows)
+  X_train, X_test, y_train, y_test = X[:n], X[n:], y[:n], y[n:]
+  if backend == "index":
+    model = EmbeddingIndex(threshold=threshold)
+  else:
+    warm = prev.get("clf") if mode == "incremental" and isinstance(prev.get("clf"), LogisticRegression) else None
+    model = warm_start_classifier(warm, X_train, y_train)
+  with timed("train_fit"):
+    clf = model.fit(X_train, y_train)
   acc = float(clf.score(X_test, y_test)) if len(X_test) > 0 else None
-  joblib.dump({"clf": clf}, MODEL_PATH)
+  # last chance to cancel before the new model replaces the old one
+  if job is not None: job.update(stage="saving")
+  os.makedirs(os.path.dirname(model_path), exist_ok=True)
+  with timed("train_save"):
+    # the model file names its store generation, so a load between these two
+    # steps gets the old model with the old faces, never a mix. the old
+    # generation stays for anyone who read the old model file just before
+    store = registry.store(movie_id)
+    old_gen = store.current()
+    gen = store.write(faces, STORE_DTYPE)
+    tmp = f"{model_path}.{os.getpid()}.tmp"
+    joblib.dump({"clf": clf, "store": gen, "backend": backend,
+                 "threshold": threshold if backend == "index" else None}, tmp)
+    os.replace(tmp, model_path)
+    store.prune(keep={gen, old_gen})
+  if backend == "index":
+    # serve the gallery from the generation just written, as a load would,
+    # rather than the float32 copy fit() made
+    clf.attach(store.open(gen)["X"])
+  registry.put(movie_id, clf)
+  predictions.invalidate(movie_id)
   labels = sorted(set(y))
-  return {"ok": True, "acc": acc, "classes": labels}
+  res = {"ok": True, "acc": acc, "classes": labels, "faces": len(X),
+         "assigned": int((faces["confidence"] < 1).sum()), "mode": mode, "backend": backend}
+  if backend == "index":
+    res["threshold"] = clf.threshold
+  return res
 
-@app.post("/predict")
-async def predict(image: UploadFile = File(...)):
-  global clf
+# large uploads are decoded only as big as the predict detector needs (see downscale.py)
+DETECT_SIDE = max(get_profile(PREDICT_PROFILE)["det_size"])
+
+decoders = ThreadPoolExecutor(min(4, os.cpu_count() or 1), thread_name_prefix="decode")
+
+def decode(raw, timings=None):
+  with timed("decode", timings):
+    return Upload(raw, DETECT_SIDE)
+
+# per-image lists of {"name", "box"} for decoded uploads. detection runs here,
+# the face crops go to the micro-batcher and share a recognition pass with
+# other requests
+def recognize(clf, uploads, timings=None):
+  with timed("detect", timings):
+    boxes, crops = detect_and_align_uploads(uploads)
+  for b in boxes:
+    FACES_PER_IMAGE.observe(len(b), source="predict")
+  names = batcher.classify(clf, crops, timings)
+  out, i = [], 0
+  for b in boxes:
+    results = []
+    for x1,y1,x2,y2 in b.astype(int).tolist():
+      results.append({"name": names[i], "box": [x1,y1,x2,y2]})
+      i += 1
+    out.append(results)
+  return out
+
+# these run on the inference pool: model lookup (possibly a first load from
+# disk), decoding and the face pipeline all stay off the event loop
+def predict_raw(movie_id, raw, timings=None):
+  clf = registry.get(movie_id)
+  return None if clf is None else recognize(clf, [decode(raw, timings)], timings)[0]
+
+# per upload: its results and whether it decoded at all
+def predict_images(movie_id, raws, timings=None):
+  clf = registry.get(movie_id)
   if clf is None:
-    if os.path.exists(MODEL_PATH):
-      clf = joblib.load(MODEL_PATH)["clf"]
-    else:
-      return {"ok": False, "msg": "model not trained"}
+    return None
+  # cv2 releases the GIL while decoding, so the uploads are decoded side by side
+  t = time.perf_counter()
+  uploads = list(decoders.map(decode, raws))
+  if timings is not None:
+    timings["decode"] = round((time.perf_counter() - t) * 1000, 3)
+  return list(zip(recognize(clf, uploads, timings), [u.small is not None for u in uploads]))
+
+# a cached answer is only valid for the model file and detector settings it
+# came from, None when there is no model yet (nothing to cache)
+def prediction_version(movie_id):
+  mtime = registry.version(movie_id)
+  return None if mtime is None else f"{MODEL_NAME}-{profile_tag(PREDICT_PROFILE)}-{mtime}"
+
+# cached results per upload (None on a miss) and the content keys to store new ones under
+async def cached_predictions(movie_id, version, raws, timings):
+  if version is None:
+    return [None] * len(raws), [None] * len(raws)
+  with timed("cache_lookup", timings):
+    keys = await asyncio.gather(*(asyncio.to_thread(content_key, raw) for raw in raws))
+    found = [predictions.get(movie_id, version, key) for key in keys]
+  for f in found:
+    RESULT_CACHE.inc(outcome="miss" if f is None else "hit")
+  return found, keys
+
+# timings=true adds a per-stage breakdown in milliseconds to the response:
+# queue_wait, decode, detect (with alignment), then the embed and classify
+# time of the shared recognition batch and batch_wait spent waiting for it.
+# an image seen before with the same model is answered from the result cache
+@app.post("/predict")
+async def predict(image: UploadFile = File(...), movie_id: int = None, timings: bool = False):
+  spent = {} if timings else None
   raw = await image.read()
-  npimg = np.frombuffer(raw, np.uint8)
-  img = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-  faces = face_app.get(img)
-  results = []
-  for f in faces:
-    embedding = f.normed_embedding
-    name = clf.predict([embedding])[0]
-    x1,y1,x2,y2 = map(int, f.bbox)
-    results.append({"name": name, "box": [x1,y1,x2,y2]})
-  return {"ok": True, "results": results}
+  version = prediction_version(movie_id)
+  (results,), (key,) = await cached_predictions(movie_id, version, [raw], spent)
+  if results is None:
+    results = await infer.run(predict_raw, movie_id, raw, spent, timings=spent)
+    if results is None:
+      return {"ok": False, "msg": "model not trained"}
+    if key is not None:
+      predictions.put(movie_id, version, key, results)
+  res = {"ok": True, "results": results}
+  if timings:
+    res["timings"] = spent
+  return res
+
+@app.post("/predict_batch")
+async def predict_batch(images: List[UploadFile] = File(...), movie_id: int = None, timings: bool = False):
+  spent = {} if timings else None
+  raws = await asyncio.gather(*(im.read() for im in images))
+  version = prediction_version(movie_id)
+  results, keys = await cached_predictions(movie_id, version, raws, spent)
+  todo = [i for i, r in enumerate(results) if r is None]
+  ok = [True] * len(raws)
+  if todo:
+    fresh = await infer.run(predict_images, movie_id, [raws[i] for i in todo], spent, timings=spent)
+    if fresh is None:
+      return {"ok": False, "msg": "model not trained"}
+    for i, (r, decoded) in zip(todo, fresh):
+      results[i], ok[i] = r, decoded
+      # undecodable uploads are not cached, they keep reporting ok: false
+      if decoded and keys[i] is not None:
+        predictions.put(movie_id, version, keys[i], r)
+  res = {"ok": True, "images": [
+    {"filename": im.filename, "ok": o, "results": r}
+    for im, o, r in zip(images, ok, results)
+  ]}
+  if timings:
+    res["timings"] = spent
+  return res
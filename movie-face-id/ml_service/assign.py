@@ -0,0 +1,37 @@
+import numpy as np
+
+# group shots in a role's folder: instead of dropping every image with more
+# than one face, the face most like the role's prototype (the normalised mean
+# of its single-face images) is kept, if it is similar enough and clearly ahead
+# of the image's other faces. its similarity is the pick's confidence
+
+# {role: unit prototype} from single-face embeddings (L2-normalised rows)
+def role_prototypes(X, y):
+  protos = {}
+  for role in np.unique(y):
+    mean = X[y == role].mean(axis=0)
+    protos[role] = mean / (np.linalg.norm(mean) + 1e-12)
+  return protos
+
+# groups: one (k, d) array of face embeddings per multi-face image, roles: the
+# role of each image. returns the picked face per image (-1 for none) and its
+# cosine to the prototype, all images scored in one pass
+def assign_faces(groups, roles, protos, min_similarity=0.3, min_margin=0.1):
+  n = len(groups)
+  if n == 0:
+    return np.zeros(0, np.int64), np.zeros(0, np.float32)
+  sizes = np.array([len(g) for g in groups])
+  offsets = np.r_[0, np.cumsum(sizes)[:-1]]
+  faces = np.concatenate(groups)
+  image = np.repeat(np.arange(n), sizes)
+  dim = faces.shape[1]
+  P = np.stack([protos.get(r, np.zeros(dim, np.float32)) for r in roles])
+  sim = np.einsum("ij,ij->i", faces, P[image])
+  # per image, best face first
+  order = np.lexsort((-sim, image))
+  best = order[offsets]
+  second = np.where(sizes > 1, sim[order[np.minimum(offsets + 1, len(sim) - 1)]], -1.0)
+  confidence = sim[best].astype(np.float32)
+  has_proto = np.array([r in protos for r in roles])
+  ok = has_proto & (confidence >= min_similarity) & (confidence - second >= min_margin)
+  return np.where(ok, best - offsets, -1), confidence
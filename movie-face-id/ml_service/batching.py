@@ -0,0 +1,85 @@
+from concurrent.futures import Future
+import queue, threading, time
+import numpy as np
+from face_pipeline import embed_crops
+from metrics import BATCH_FACES, timed
+
+# collects aligned face crops from concurrent requests and runs the recognition
+# model once over all of them. a batch closes when max_faces crops are waiting
+# or max_wait seconds after its first request arrived, whichever comes first,
+# so max_wait is the most latency batching can add to a request. active(), if
+# given, is how many callers are working on a request right now; once every
+# one of them is in the batch nobody else can join, so it closes straight away.
+# callers are the inference workers, so a batch never holds more requests than
+# there are workers
+class MicroBatcher:
+  def __init__(self, max_faces=32, max_wait=0.005, active=None):
+    self.max_faces = max_faces
+    self.max_wait = max_wait
+    self.active = active
+    self.queue = queue.Queue()
+    threading.Thread(target=self.loop, name="microbatch", daemon=True).start()
+
+  # blocks the calling (inference worker) thread until its names are ready.
+  # timings, if given, gets the shared embed/classify times of the batch this
+  # request rode in plus batch_wait, the rest of the time spent in here
+  def classify(self, clf, crops, timings=None):
+    if not crops:
+      return []
+    t = time.perf_counter()
+    fut = Future()
+    self.queue.put((clf, crops, fut))
+    names, spent = fut.result()
+    if timings is not None:
+      timings.update(spent)
+      timings["batch_wait"] = round((time.perf_counter() - t) * 1000 - sum(spent.values()), 3)
+    return names
+
+  def loop(self):
+    while True:
+      batch = [self.queue.get()]
+      n = len(batch[0][1])
+      deadline = time.monotonic() + self.max_wait
+      while n < self.max_faces:
+        try:
+          item = self.queue.get_nowait()
+        except queue.Empty:
+          left = deadline - time.monotonic()
+          if left <= 0 or (self.active is not None and len(batch) >= self.active()):
+            break
+          # short waits, so a caller that finishes without any faces to
+          # classify doesn't keep the batch open until the deadline
+          try:
+            item = self.queue.get(timeout=min(left, self.max_wait / 10))
+          except queue.Empty:
+            continue
+        batch.append(item)
+        n += len(item[1])
+      self.run(batch)
+
+  def run(self, batch):
+    try:
+      stacked = [c for _, crops, _ in batch for c in crops]
+      BATCH_FACES.observe(len(stacked))
+      spent = {}
+      with timed("embed", spent):
+        embeddings = embed_crops(stacked)
+      # requests for the same movie share a classifier, so one predict per model
+      groups = {}
+      start = 0
+      for clf, crops, fut in batch:
+        groups.setdefault(id(clf), (clf, []))[1].append((fut, start, start + len(crops)))
+        start += len(crops)
+      for clf, members in groups.values():
+        rows = np.concatenate([np.arange(a, b) for _, a, b in members])
+        group_spent = dict(spent)
+        with timed("classify", group_spent):
+          names = clf.predict(embeddings[rows])
+        offset = 0
+        for fut, a, b in members:
+          fut.set_result((list(names[offset:offset + b - a]), group_spent))
+          offset += b - a
+    except Exception as e:
+      for _, _, fut in batch:
+        if not fut.done():
+          fut.set_exception(e)
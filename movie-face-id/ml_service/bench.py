@@ -0,0 +1,262 @@
+import argparse, json, os, resource, shutil, sys, tempfile, threading, time
+import cv2
+import numpy as np
+
+# end-to-end benchmarks: embedding throughput, train time over a grid of cast
+# sizes, /predict latency under concurrency and the memory high-water mark.
+# fixtures are generated (or sampled from a real faces folder with --faces) and
+# --stub swaps the face models for a cheap deterministic stand-in, so the suite
+# runs offline and measures the service around the models rather than onnx.
+# results can be stored as a baseline and later runs are checked against it
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# stand-in for insightface's FaceAnalysis. the detector reports the centre
+# square every fixture puts its face in, and recognition projects a downscaled
+# crop, so a role's faces (same colour) land close together
+class StubDetector:
+  taskname = "detection"
+
+  def prepare(self, ctx_id, input_size=None, det_thresh=0.5):
+    self.input_size, self.det_thresh = input_size, det_thresh
+
+  def detect(self, img, max_num=0, metric="default"):
+    h, w = img.shape[:2]
+    s = min(h, w) * 0.4
+    x1, y1 = (w - s) / 2, (h - s) / 2
+    kps = np.array([[0.34, 0.46], [0.66, 0.46], [0.5, 0.64], [0.37, 0.82], [0.63, 0.82]]) * s + [x1, y1]
+    return (np.array([[x1, y1, x1 + s, y1 + s, 0.99]], np.float32),
+            kps[None].astype(np.float32))
+
+class StubRecognizer:
+  taskname = "recognition"
+  input_size = (112, 112)
+
+  def __init__(self):
+    self.proj = np.random.default_rng(0).normal(size=(8 * 8 * 3, 512)).astype(np.float32)
+
+  def prepare(self, ctx_id):
+    pass
+
+  def get_feat(self, imgs):
+    small = np.stack([cv2.resize(im, (8, 8), interpolation=cv2.INTER_AREA) for im in imgs])
+    return small.reshape(len(imgs), -1).astype(np.float32) / 255 @ self.proj
+
+class StubFace(dict):
+  __getattr__ = dict.get
+
+class StubFaceAnalysis:
+  def __init__(self, name=None, root=None, providers=None, allowed_modules=None, **kwargs):
+    self.models = {"detection": StubDetector(), "recognition": StubRecognizer()}
+    self.det_model = self.models["detection"]
+
+  def prepare(self, ctx_id, det_thresh=0.5, det_size=(640, 640)):
+    self.det_thresh, self.det_size = det_thresh, det_size
+    self.det_model.prepare(ctx_id, input_size=det_size, det_thresh=det_thresh)
+
+  def get(self, img, max_num=0):
+    from insightface.utils import face_align
+    bboxes, kpss = self.det_model.detect(img)
+    rec = self.models["recognition"]
+    faces = []
+    for b, kps in zip(bboxes, kpss):
+      emb = rec.get_feat([face_align.norm_crop(img, landmark=kps, image_size=rec.input_size[0])])[0]
+      faces.append(StubFace(bbox=b[:4], kps=kps, det_score=b[4], embedding=emb,
+                            normed_embedding=emb / np.linalg.norm(emb)))
+    return faces
+
+# has to run before app (and so face_pipeline) is imported. the stub has no
+# onnx sessions to rebuild, and worker processes would load the real models,
+# so embedding stays in-process
+def install_stub():
+  import insightface.app
+  insightface.app.FaceAnalysis = StubFaceAnalysis
+  import parallel_embed
+  parallel_embed.limit_threads = lambda face_app, threads: None
+  os.environ["EMBED_WORKERS"] = "1"
+
+# faces/<role>/<i>.jpg. synthetic: a noisy background with a role-coloured,
+# lightly jittered square in the middle; with source, the first images of the
+# first roles of a real labeled folder
+def make_fixtures(faces_dir, classes, per_class, source=None, size=256, seed=0):
+  rng = np.random.default_rng(seed)
+  roles = sorted(os.listdir(source))[:classes] if source else [f"role{c:03d}" for c in range(classes)]
+  for role in roles:
+    os.makedirs(os.path.join(faces_dir, role), exist_ok=True)
+    if source:
+      for fn in sorted(os.listdir(os.path.join(source, role)))[:per_class]:
+        shutil.copyfile(os.path.join(source, role, fn), os.path.join(faces_dir, role, fn))
+      continue
+    colour = rng.integers(30, 226, 3)
+    for i in range(per_class):
+      img = rng.integers(0, 60, (size, size, 3)).astype(np.int16)
+      s, o = int(size * 0.4), int(size * 0.3)
+      img[o:o + s, o:o + s] = colour + rng.integers(-8, 9, 3)
+      cv2.imwrite(os.path.join(faces_dir, role, f"{i}.jpg"), np.clip(img, 0, 255).astype(np.uint8))
+  return roles
+
+def peak_rss_mb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on linux
+
+def percentile_ms(samples, q):
+  return round(float(np.percentile(samples, q)) * 1000, 2) if samples else None
+
+def bench_embed(app, faces_dir, results):
+  for run in ("cold", "warm"):
+    t = time.perf_counter()
+    faces = app.load_embeddings_from_faces(data_dir=faces_dir)
+    elapsed = time.perf_counter() - t
+    n = sum(len(files) for _, _, files in os.walk(faces_dir))
+    results[f"embed_{run}_images_per_s"] = round(n / elapsed, 1)
+  results["embed_faces_kept"] = len(faces["X"])
+
+# train time with a warm embedding cache, so this is load + fit + save. sklearn
+# is only imported by the first train, that cost is reported on its own
+def bench_train(app, grid, source, results):
+  t = time.perf_counter()
+  import sklearn.linear_model, sklearn.model_selection
+  results["train_import_s"] = round(time.perf_counter() - t, 3)
+  for i, (classes, per_class) in enumerate(grid):
+    movie_id = 1000 + i
+    make_fixtures(app.registry.faces_dir(movie_id), classes, per_class, source, seed=i)
+    app.load_embeddings_from_faces(data_dir=app.registry.faces_dir(movie_id))
+    t = time.perf_counter()
+    res = app.run_train(None, movie_id=movie_id)
+    results[f"train_{classes}x{per_class}_s"] = round(time.perf_counter() - t, 3)
+    if not res["ok"]:
+      raise RuntimeError(f"train {classes}x{per_class} failed: {res['msg']}")
+
+def bench_predict(app, client, images, movie_id, levels, requests, results):
+  for level in levels:
+    latencies, statuses, lock = [], {}, threading.Lock()
+    def worker(n):
+      for j in range(n):
+        raw = images[j % len(images)]
+        t = time.perf_counter()
+        r = client.post("/predict", params={"movie_id": movie_id}, files={"image": ("f.jpg", raw, "image/jpeg")})
+        with lock:
+          latencies.append(time.perf_counter() - t)
+          statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+    per = max(1, requests // level)
+    threads = [threading.Thread(target=worker, args=(per,)) for _ in range(level)]
+    t = time.perf_counter()
+    for th in threads: th.start()
+    for th in threads: th.join()
+    wall = time.perf_counter() - t
+    for q in (50, 95, 99):
+      results[f"predict_c{level}_p{q}_ms"] = percentile_ms(latencies, q)
+    results[f"predict_c{level}_rps"] = round(len(latencies) / wall, 1)
+    results[f"predict_c{level}_non_200"] = sum(v for k, v in statuses.items() if k != 200)
+
+def run(args):
+  if args.stub:
+    install_stub()
+  root = tempfile.mkdtemp(prefix="bench-")
+  os.environ.setdefault("WARM_UP", "1")
+  # everything the benchmark writes stays in root. app builds its embedding and
+  # TMDB caches at import, so those paths are set first
+  os.environ["CACHE_DIR"] = os.path.join(root, "embeddings")
+  os.environ["TMDB_CACHE"] = os.path.join(root, "tmdb.sqlite")
+  results = {"stub": args.stub}
+  try:
+    import app
+    from registry import ModelRegistry
+    from result_cache import ResultCache
+    from fastapi.testclient import TestClient
+    # the faces and models it trains
+    app.registry = ModelRegistry(root, app.MODEL_CACHE_MB * 2**20)
+    # the fixtures repeat, so without this /predict would mostly time cache hits
+    app.predictions = ResultCache(0)
+    # the stub embeds a synthetic role's images as near copies of one face, so
+    # the post-embedding dedup would leave one face per role
+    if not args.faces:
+      app.DEDUP_COSINE = 2.0
+    results["rss_after_import_mb"] = round(peak_rss_mb(), 1)
+
+    faces_dir = os.path.join(root, "faces")
+    make_fixtures(faces_dir, args.classes, args.per_class, args.faces)
+    bench_embed(app, faces_dir, results)
+    results["rss_after_embed_mb"] = round(peak_rss_mb(), 1)
+
+    grid = [tuple(int(v) for v in g.split("x")) for g in args.train_grid.split(",")]
+    bench_train(app, grid, args.faces, results)
+    results["rss_after_train_mb"] = round(peak_rss_mb(), 1)
+
+    movie_id = 1000 + len(grid) - 1
+    pred_dir = app.registry.faces_dir(movie_id)
+    images = []
+    for role in sorted(os.listdir(pred_dir))[:16]:
+      fn = sorted(os.listdir(os.path.join(pred_dir, role)))[0]
+      with open(os.path.join(pred_dir, role, fn), "rb") as fh:
+        images.append(fh.read())
+    with TestClient(app.app) as client:
+      t = time.perf_counter()
+      while client.get("/ready").status_code != 200:
+        if time.perf_counter() - t > 300:
+          raise RuntimeError("service never became ready")
+        time.sleep(0.05)
+      results["model_warm_up_s"] = round(time.perf_counter() - t, 2)
+      levels = [int(v) for v in args.concurrency.split(",")]
+      bench_predict(app, client, images, movie_id, levels, args.requests, results)
+    results["rss_peak_mb"] = round(peak_rss_mb(), 1)
+  finally:
+    shutil.rmtree(root, ignore_errors=True)
+  return results
+
+# higher is better for throughput, lower for everything else we time or count
+def higher_is_better(metric):
+  return metric.endswith(("_per_s", "_rps", "_faces_kept"))
+
+# differences below these never count, so timer noise on tiny values doesn't fail a run
+SLACK = {"_ms": 2.0, "_s": 0.05, "_mb": 16.0}
+
+# metrics more than tolerance (a fraction) worse than the baseline
+def regressions(results, baseline, tolerance):
+  out = []
+  for metric, base in baseline.items():
+    now = results.get(metric)
+    if not isinstance(base, (int, float)) or isinstance(base, bool) or not isinstance(now, (int, float)):
+      continue
+    slack = next((v for suffix, v in SLACK.items() if metric.endswith(suffix)), 0.0)
+    if higher_is_better(metric):
+      worse = now < base * (1 - tolerance)
+    else:
+      worse = now > base * (1 + tolerance) + slack
+    if worse:
+      out.append({"metric": metric, "baseline": base, "now": now})
+  return out
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="benchmark embedding, training and /predict end to end")
+  parser.add_argument("--stub", action="store_true", help="replace the face models with a cheap offline stand-in")
+  parser.add_argument("--faces", default=None, help="sample fixtures from this labeled faces folder instead of generating them")
+  parser.add_argument("--classes", type=int, default=8, help="roles in the embedding fixture set")
+  parser.add_argument("--per-class", type=int, default=20, help="images per role in the embedding fixture set")
+  parser.add_argument("--train-grid", default="5x10,5x40,20x10,20x40", help="CLASSESxIMAGES train sizes")
+  parser.add_argument("--concurrency", default="1,4,16", help="concurrent /predict clients per level")
+  parser.add_argument("--requests", type=int, default=64, help="/predict calls per concurrency level")
+  parser.add_argument("--baseline", default=BASELINE)
+  parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a metric counts as a regression")
+  parser.add_argument("--json", default=None, help="also write the results here")
+  args = parser.parse_args()
+
+  results = run(args)
+  print(json.dumps(results, indent=2))
+  if args.json:
+    with open(args.json, "w") as fh:
+      json.dump(results, fh, indent=2)
+  if args.save_baseline:
+    with open(args.baseline, "w") as fh:
+      json.dump(results, fh, indent=2)
+    print(f"baseline written to {args.baseline}", file=sys.stderr)
+  elif os.path.exists(args.baseline):
+    with open(args.baseline) as fh:
+      baseline = json.load(fh)
+    if baseline.get("stub") != results["stub"]:
+      print("baseline was recorded with a different --stub setting, not comparing", file=sys.stderr)
+    else:
+      found = regressions(results, baseline, args.tolerance)
+      for r in found:
+        print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['now']}", file=sys.stderr)
+      sys.exit(1 if found else 0)
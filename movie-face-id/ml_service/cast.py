@@ -0,0 +1,118 @@
+import argparse, json, re, sys
+import numpy as np
+
+# the cast selection the notebook (get_main_cast_refined) and the gateway have
+# always used: the top `always` billed roles, then progressively stricter
+# popularity cuts down to 60% of the cast, skipping uncredited, voice and extra
+# roles. it runs column-wise over a table of credit rows from any number of
+# movies, so a whole catalogue is one pass
+
+BANDS = (0.10, 0.30, 0.60)    # fraction of the cast each band after the top `always` reaches
+FLOORS = (-np.inf, 2.0, 2.2, 2.5)  # minimum popularity per band
+
+def title_case(s):
+  return re.sub(r"\w\S*", lambda m: m.group(0)[0].upper() + m.group(0)[1:].lower(), s)
+
+# {movie_id: [tmdb cast dicts]} -> columns, rows grouped by movie and in billing order
+def credits_table(credits):
+  movie, movie_idx, name, character, order, popularity = [], [], [], [], [], []
+  for i, (movie_id, cast) in enumerate(credits.items()):
+    for c in cast:
+      movie.append(movie_id)
+      movie_idx.append(i)
+      name.append(c["name"])
+      character.append(c.get("character") or "")
+      order.append(c.get("order") if c.get("order") is not None else 999)
+      popularity.append(c.get("popularity") or 0)
+  # stable sort, equal billing keeps TMDB's order like the old sorts did
+  movie_idx = np.array(movie_idx, np.int64)
+  idx = np.lexsort((np.array(order, np.int64), movie_idx))
+  return {"movie": np.array(movie, dtype=object)[idx], "movie_idx": movie_idx[idx],
+          "name": np.array(name, dtype=object)[idx], "character": np.array(character, dtype=object)[idx],
+          "order": np.array(order, np.int64)[idx], "popularity": np.array(popularity, np.float64)[idx]}
+
+# selected mask and an exclusion reason per row ("" for selected rows)
+def select_table(table, always=5):
+  n = len(table["movie_idx"])
+  if n == 0:
+    return np.zeros(0, bool), np.zeros(0, dtype=object)
+  starts = np.flatnonzero(np.r_[True, table["movie_idx"][1:] != table["movie_idx"][:-1]])
+  sizes = np.diff(np.r_[starts, n])
+  rank = np.arange(n) - np.repeat(starts, sizes)
+  total = np.repeat(sizes, sizes)
+  cutoffs = [np.full(n, always)]
+  for frac in BANDS:
+    cutoffs.append(np.maximum((total * frac).astype(np.int64), cutoffs[-1]))
+  band = sum((rank >= cut).astype(np.int64) for cut in cutoffs[:-1])
+  floor = np.array(FLOORS)[band]
+
+  character = np.char.lower(table["character"].astype(str))
+  has = lambda s: np.char.find(character, s) >= 0
+  uncredited = has("uncredited")
+  object_role = has("voice") | has("the ring")
+  extra = (np.char.str_len(character) <= 1) | has("#")
+  outside = rank >= cutoffs[-1]
+  unpopular = table["popularity"] < floor
+
+  reason = np.full(n, "", dtype=object)
+  # the first rule that applies wins, same precedence as the loop it replaces
+  for mask, text in ((unpopular, "popularity below band minimum"),
+                     (extra, "one of many extras or name too short"),
+                     (object_role, "non-human or object role"),
+                     (uncredited, "uncredited role"),
+                     (outside, "beyond the first 60% of the cast")):
+    reason[mask] = text
+  return reason == "", reason
+
+def select_many(credits, always=5):
+  table = credits_table(credits)
+  selected, reason = select_table(table, always)
+  out = {movie_id: {"main": {}, "full": [], "excluded": []} for movie_id in credits}
+  for i in range(len(selected)):
+    res = out[table["movie"][i]]
+    row = {"name": table["name"][i], "character": table["character"][i],
+           "order": int(table["order"][i]), "popularity": float(table["popularity"][i])}
+    res["full"].append(row)
+    if selected[i]:
+      res["main"][row["name"]] = title_case(row["character"].lower())
+    else:
+      res["excluded"].append({**row, "reason": reason[i]})
+  return out
+
+# {"main": {actor: role}, "full": [...], "excluded": [... with "reason"]} for one movie
+def select_cast(cast, always=5):
+  return select_many({0: cast}, always)[0]
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="pick the main cast of many movies in one pass")
+  parser.add_argument("credits", help='JSONL of {"id": tmdb id, "cast": [...]}, or with --tmdb-cache a file of ids')
+  parser.add_argument("--tmdb-cache", default=None, help="read credits from this tmdb.sqlite instead")
+  parser.add_argument("--always", type=int, default=5)
+  parser.add_argument("--out", default="-", help="JSONL of {id, main, excluded}, - for stdout")
+  args = parser.parse_args()
+
+  credits = {}
+  with open(args.credits) as fh:
+    lines = [line.strip() for line in fh if line.strip()]
+  if args.tmdb_cache:
+    from tmdb import ResponseCache, cache_key
+    cache = ResponseCache(args.tmdb_cache)
+    for movie_id in map(int, lines):
+      hit = cache.get(cache_key(f"/movie/{movie_id}/credits", {}))
+      if hit is None:
+        print(f"{movie_id}: credits not cached, skipped", file=sys.stderr)
+        continue
+      credits[movie_id] = hit[1].get("cast", [])
+  else:
+    for line in lines:
+      movie = json.loads(line)
+      credits[movie["id"]] = movie.get("cast", [])
+
+  results = select_many(credits, args.always)
+  out = sys.stdout if args.out == "-" else open(args.out, "w")
+  try:
+    for movie_id, res in results.items():
+      out.write(json.dumps({"id": movie_id, "main": res["main"], "excluded": res["excluded"]}) + "\n")
+  finally:
+    if out is not sys.stdout:
+      out.close()
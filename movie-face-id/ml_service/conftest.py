@@ -0,0 +1,37 @@
+import json, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import pytest
+
+# a local HTTP server for the tests that talk to one (scrape, tmdb). a test sets
+# server.respond to a function of (path, params) returning (status, body,
+# headers); a dict or list body is sent as JSON. every request's path and
+# params are recorded in server.requests
+class StubHandler(BaseHTTPRequestHandler):
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    url = urlsplit(self.path)
+    params = {k: v[0] for k, v in parse_qs(url.query).items()}
+    self.server.requests.append((url.path, params))
+    status, body, headers = self.server.respond(url.path, params)
+    if isinstance(body, (dict, list)):
+      body, headers = json.dumps(body).encode(), {"Content-Type": "application/json", **headers}
+    self.send_response(status)
+    for k, v in headers.items():
+      self.send_header(k, v)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+@pytest.fixture
+def server():
+  httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+  httpd.requests = []
+  httpd.respond = lambda path, params: (404, b"", {})
+  httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+  threading.Thread(target=httpd.serve_forever, daemon=True).start()
+  yield httpd
+  httpd.shutdown()
+  httpd.server_close()
@@ -0,0 +1,73 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image
+from metrics import timed
+import face_pipeline
+
+# big uploads (4K screenshots, posters) are only detected on at a reduced
+# resolution that is still at least the detector's input size, since the
+# detector scales everything down to that anyway. libjpeg can decode straight
+# to 1/2, 1/4 or 1/8 scale, which is much cheaper than a full decode; other
+# formats are decoded in full once and shrunk for detection
+REDUCED = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# (format, (width, height)) from the file header without decoding
+def image_info(raw):
+  try:
+    im = Image.open(io.BytesIO(raw))
+    return im.format, im.size
+  except Exception:
+    return None, None
+
+# the largest of 1/8, 1/4, 1/2 that keeps a side of `length` at least `target`
+def reduction(length, target):
+  return next((f for f in (8, 4, 2) if length / f >= target), 1)
+
+def decode_at(raw, factor):
+  return cv2.imdecode(np.frombuffer(raw, np.uint8), REDUCED.get(factor, cv2.IMREAD_COLOR))
+
+# one upload: small is what detection sees and scale maps its coordinates back
+# to the original image. crops come from a second, larger decode only when the
+# faces are too small in `small` for the recognition model (see at_least)
+class Upload:
+  def __init__(self, raw, target):
+    self.raw = raw
+    fmt, size = image_info(raw)
+    self.scale = reduction(max(size), target) if size else 1
+    self.full = None
+    if fmt == "JPEG" or self.scale == 1:
+      self.small = decode_at(raw, self.scale)
+    else:
+      self.full = decode_at(raw, 1)
+      self.small = None if self.full is None else cv2.resize(
+        self.full, None, fx=1 / self.scale, fy=1 / self.scale, interpolation=cv2.INTER_AREA)
+
+  # the image decoded large enough that a face whose shortest side is `side`
+  # original pixels spans `size` pixels, with the factor it was decoded at
+  def at_least(self, side, size):
+    factor = reduction(side, size)
+    if factor >= self.scale:
+      return self.small, self.scale
+    if self.full is not None:
+      return self.full, 1
+    with timed("decode_crops"):
+      return decode_at(self.raw, factor), factor
+
+# detection on the reduced image, boxes mapped back to original pixels. the
+# face crops are cut from the smallest decode in which every face is at least
+# the recognition model's input size, which for big faces is `small` itself
+def detect_and_align_uploads(uploads):
+  boxes, crops = [], []
+  size = face_pipeline.crop_size()
+  for u in uploads:
+    if u.small is None:
+      boxes.append(np.zeros((0, 4), np.float32))
+      continue
+    b, _, kpss = face_pipeline.detect(u.small)
+    b, kpss = b * u.scale, kpss * u.scale
+    if len(b):
+      img, factor = u.at_least(np.minimum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]).min(), size)
+      crops.extend(face_pipeline.align(img, kpss / factor))
+    boxes.append(b)
+  return boxes, crops
@@ -0,0 +1,41 @@
+import hashlib, os, threading
+import numpy as np
+
+# on-disk store of face detections keyed by image content hash + model name
+# every face found in an image is kept (embedding, box, detector score) so a
+# retrain only pays for detection on files that are new or have changed
+EMBED_DIM = 512
+
+def content_key(raw):
+  return hashlib.sha1(raw).hexdigest()
+
+class EmbeddingCache:
+  def __init__(self, root, model_name):
+    self.dir = os.path.join(root, model_name)
+    os.makedirs(self.dir, exist_ok=True)
+
+  def _path(self, key):
+    return os.path.join(self.dir, key[:2], key + ".npz")
+
+  def get(self, key):
+    path = self._path(key)
+    if not os.path.exists(path):
+      return None
+    try:
+      with np.load(path) as d:
+        return d["embeddings"], d["boxes"], d["scores"]
+    except (OSError, ValueError, KeyError):
+      # half-written or corrupt entry, recompute it
+      return None
+
+  def put(self, key, embeddings, boxes, scores):
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # unique temp name, several workers may embed the same image at once
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as fh:
+      np.savez(fh,
+               embeddings=np.asarray(embeddings, np.float32).reshape(-1, EMBED_DIM),
+               boxes=np.asarray(boxes, np.float32).reshape(-1, 4),
+               scores=np.asarray(scores, np.float32).reshape(-1))
+    os.replace(tmp, path)
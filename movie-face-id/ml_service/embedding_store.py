@@ -0,0 +1,76 @@
+import json, os, shutil, threading, time
+import numpy as np
+
+# a model's training faces on disk, one .npy file per column so every column
+# opens with np.load(mmap_mode="r"): opening is constant time whatever the
+# size, and rows are only paged in when something reads them.
+#   X           (n, d) embeddings, float16 by default (L2-normalised rows lose
+#               nothing that matters to a cosine), float32 on request
+#   label       (n,) int32 index into the role names in meta.json
+#   path        (n,) source image, relative to the movie's faces folder
+#   box, score  (n, 4) detector box and (n,) detector score
+#   confidence  (n,) 1 for single-face images, the assignment similarity for
+#               faces picked out of a group shot (see assign.py)
+# every write goes to a new generation directory and then `current` is swapped
+# to point at it, so a store that is open never changes under its reader. a
+# model file records the generation it was trained on and opens exactly that
+# one; prune() drops the older generations once no model file points at them
+COLUMNS = ("X", "label", "path", "box", "score", "confidence")
+
+class EmbeddingStore:
+  def __init__(self, root):
+    self.root = root
+
+  def current(self):
+    try:
+      with open(os.path.join(self.root, "current")) as fh:
+        return fh.read().strip() or None
+    except FileNotFoundError:
+      return None
+
+  def exists(self):
+    return self.current() is not None
+
+  # faces: {"X", "y", "path", "box", "score", "confidence"} as load_embeddings_from_faces
+  # returns it. returns the new generation's id
+  def write(self, faces, dtype="float16"):
+    gen = f"{time.time_ns():x}"
+    gen_dir = os.path.join(self.root, gen)
+    os.makedirs(gen_dir)
+    classes, label = np.unique(np.asarray(faces["y"], str), return_inverse=True)
+    columns = {"X": np.asarray(faces["X"], dtype).reshape(len(label), -1),
+               "label": label.astype(np.int32),
+               "path": np.asarray(faces["path"], str).reshape(-1),
+               "box": np.asarray(faces["box"], np.float32).reshape(-1, 4),
+               "score": np.asarray(faces["score"], np.float32).reshape(-1),
+               "confidence": np.asarray(faces["confidence"], np.float32).reshape(-1)}
+    for name in COLUMNS:
+      np.save(os.path.join(gen_dir, name + ".npy"), columns[name])
+    with open(os.path.join(gen_dir, "meta.json"), "w") as fh:
+      json.dump({"classes": classes.tolist(), "count": len(label), "dtype": str(np.dtype(dtype))}, fh)
+    tmp = os.path.join(self.root, f"current.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as fh:
+      fh.write(gen)
+    os.replace(tmp, os.path.join(self.root, "current"))
+    return gen
+
+  # every generation but the ones in keep; on posix a reader that still maps
+  # one keeps its pages
+  def prune(self, keep):
+    for old in os.listdir(self.root):
+      if old not in keep and os.path.isdir(os.path.join(self.root, old)):
+        shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+
+  # the columns of generation gen (the current one by default), memory-mapped
+  # read-only, plus y (role names per row, the only column built in memory).
+  # None if there is nothing stored
+  def open(self, gen=None):
+    gen = gen or self.current()
+    if gen is None:
+      return None
+    gen_dir = os.path.join(self.root, gen)
+    with open(os.path.join(gen_dir, "meta.json")) as fh:
+      meta = json.load(fh)
+    faces = {name: np.load(os.path.join(gen_dir, name + ".npy"), mmap_mode="r") for name in COLUMNS}
+    faces["y"] = np.array(meta["classes"], str)[faces["label"]]
+    return faces
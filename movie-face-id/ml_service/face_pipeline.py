@@ -0,0 +1,102 @@
+from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+import os, threading
+import numpy as np
+from embed_cache import EMBED_DIM
+from parallel_embed import limit_threads
+from profiles import MODULES, TRAIN_PROFILE, get_profile
+from metrics import timed
+
+# MODEL_VARIANT=int8 (or opt) serves the pack model_variants.py wrote next to
+# the stock one; the embedding cache is keyed by this name so variants never mix
+MODEL_VARIANT = os.environ.get("MODEL_VARIANT", "")
+MODEL_NAME = f"auraface-{MODEL_VARIANT}" if MODEL_VARIANT else "auraface"
+
+# threads=None keeps onnxruntime's default of one intra-op thread per core.
+# profile picks the detector input size and threshold (see profiles.py),
+# modules which of the pack's models are loaded at all
+def build_face_app(threads=None, profile=TRAIN_PROFILE, modules=MODULES):
+  with timed("face_model_load"):
+    fa = FaceAnalysis(name=MODEL_NAME, root="models", providers=["CPUExecutionProvider"],
+                      allowed_modules=modules)
+    if threads:
+      limit_threads(fa, threads)
+    fa.prepare(ctx_id=0, **get_profile(profile))  # CPU
+  return fa
+
+# the shared FaceAnalysis (training, video scans and the micro-batcher's
+# recognition pass) is built on first use rather than at import, so importing
+# this module (and the app) stays cheap. shared_threads caps its onnx
+# sessions' intra-op threads (None: one per core); the service sets it so the
+# shared app and the inference workers split the cores instead of each taking
+# all of them
+face_app = None
+shared_threads = None
+build_lock = threading.Lock()
+
+def shared_app():
+  global face_app
+  if face_app is None:
+    with build_lock:
+      if face_app is None:
+        face_app = build_face_app(shared_threads)
+  return face_app
+
+# a thread can install its own FaceAnalysis (the inference workers do), every
+# helper below uses that one when present and the shared one otherwise
+local = threading.local()
+
+def current_app():
+  return getattr(local, "face_app", None) or shared_app()
+
+# side of the aligned face crops, the recognition model's input size. a
+# detection-only app (an inference worker's) takes it from the shared app
+def crop_size():
+  fa = current_app()
+  if "recognition" not in fa.models:
+    fa = shared_app()
+  return fa.models["recognition"].input_size[0]
+
+# one dummy pass through detection and recognition (if loaded) so the first
+# real request doesn't pay for onnxruntime's lazy allocations
+def warm_up(fa):
+  w, h = fa.det_size
+  fa.det_model.detect(np.zeros((h, w, 3), np.uint8), max_num=0, metric="default")
+  if "recognition" not in fa.models:
+    return
+  size = fa.models["recognition"].input_size[0]
+  fa.models["recognition"].get_feat([np.zeros((size, size, 3), np.uint8)])
+
+# boxes (n, 4), detector scores (n,) and 5-point landmarks (n, 5, 2)
+def detect(img):
+  bboxes, kpss = current_app().det_model.detect(img, max_num=0, metric="default")
+  return bboxes[:, :4], bboxes[:, 4], kpss
+
+def align(img, kpss):
+  size = crop_size()
+  return [face_align.norm_crop(img, landmark=kps, image_size=size) for kps in kpss]
+
+# one recognition pass over a list of aligned crops, rows come back L2-normalised
+def embed_crops(crops):
+  if not crops:
+    return np.zeros((0, EMBED_DIM), np.float32)
+  feats = current_app().models["recognition"].get_feat(crops)
+  return (feats / np.linalg.norm(feats, axis=1, keepdims=True)).astype(np.float32)
+
+# per-image boxes plus every aligned face crop, in image then face order
+def detect_and_align(imgs):
+  boxes, crops = [], []
+  for img in imgs:
+    if img is None:
+      boxes.append(np.zeros((0, 4), np.float32))
+      continue
+    b, _, kpss = detect(img)
+    boxes.append(b)
+    crops.extend(align(img, kpss))
+  return boxes, crops
+
+# detection runs per image, recognition runs once over every face in the batch.
+# returns per-image boxes and the stacked embeddings in the same order
+def detect_and_embed(imgs):
+  boxes, crops = detect_and_align(imgs)
+  return boxes, embed_crops(crops)
@@ -0,0 +1,99 @@
+import numpy as np
+
+UNKNOWN = "unknown"
+
+def normalize(X):
+  X = np.asarray(X, np.float32)
+  return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-12)
+
+# nearest-neighbour classifier over the normalised training embeddings.
+# "training" is just stacking the gallery; a face whose best cosine similarity
+# is below the threshold is reported as UNKNOWN instead of the closest cast member.
+# exposes fit/predict/score/classes_ so it can stand in for the sklearn classifier
+class EmbeddingIndex:
+  def __init__(self, k=5, threshold=None, chunk=4096):
+    self.k = k
+    self.threshold = threshold
+    self.chunk = chunk
+
+  # the gallery matrix is not pickled with the model: it is the first len(y)
+  # rows of the model's embedding store, mapped back in by attach() and read
+  # a chunk at a time, so a float16 store is never copied whole onto the heap
+  def __getstate__(self):
+    state = dict(vars(self))
+    state.pop("X", None)
+    return state
+
+  def attach(self, X):
+    self.X = X[:len(self.y)]
+    return self
+
+  def fit(self, X, y):
+    self.X = normalize(X)
+    self.classes_, self.y = np.unique(y, return_inverse=True)
+    if self.threshold is None:
+      self.threshold = self.calibrate()
+    return self
+
+  # gallery rows s to s+chunk as float32
+  def rows(self, s):
+    return np.asarray(self.X[s:s+self.chunk], np.float32)
+
+  # top-k cosine similarities and gallery indices. the gallery is walked in
+  # row chunks, keeping the best k so far, so neither the similarity matrix
+  # nor a float32 copy of the gallery ever has to exist in full
+  def search(self, E, k):
+    E = normalize(E)
+    k = min(k, len(self.X))
+    sims, idx = np.empty((len(E), 0), np.float32), np.empty((len(E), 0), np.int64)
+    for s in range(0, len(self.X), self.chunk):
+      block = self.rows(s)
+      sims = np.concatenate([sims, E @ block.T], axis=1)
+      idx = np.concatenate([idx, np.broadcast_to(np.arange(s, s + len(block)), (len(E), len(block)))], axis=1)
+      if sims.shape[1] > k:
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        sims, idx = np.take_along_axis(sims, top, axis=1), np.take_along_axis(idx, top, axis=1)
+    order = np.argsort(-sims, axis=1)
+    return np.take_along_axis(sims, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+  # similarity-weighted vote among the k nearest, plus the best similarity per query
+  def vote(self, E):
+    sims, idx = self.search(E, self.k)
+    votes = np.zeros((len(E), len(self.classes_)), np.float32)
+    np.add.at(votes, (np.arange(len(E))[:, None], self.y[idx]), np.maximum(sims, 0))
+    return votes.argmax(axis=1), sims[:, 0]
+
+  def predict(self, E):
+    if len(E) == 0:
+      return np.array([], dtype=object)
+    best, top1 = self.vote(E)
+    names = self.classes_[best].astype(object)
+    names[top1 < self.threshold] = UNKNOWN
+    return names
+
+  def score(self, X, y):
+    return float(np.mean(self.predict(X) == np.asarray(y)))
+
+  # leave-one-out over the gallery: for every embedding take its best match in
+  # the same class (genuine) and in any other class (impostor), then pick the
+  # cut that misclassifies the fewest of the two
+  def calibrate(self):
+    if len(self.classes_) < 2 or len(self.X) < 3:
+      return 0.0
+    n = len(self.X)
+    genuine = np.full(n, -np.inf, np.float32)
+    impostor = np.full(n, -np.inf, np.float32)
+    for s in range(0, n, self.chunk):
+      Q = self.rows(s)
+      for g in range(0, n, self.chunk):
+        S = Q @ self.rows(g).T
+        if g == s:
+          S[np.arange(len(Q)), np.arange(len(Q))] = -np.inf
+        same = self.y[s:s+self.chunk, None] == self.y[None, g:g+self.chunk]
+        genuine[s:s+len(Q)] = np.maximum(genuine[s:s+len(Q)], np.where(same, S, -np.inf).max(axis=1))
+        impostor[s:s+len(Q)] = np.maximum(impostor[s:s+len(Q)], np.where(same, -np.inf, S).max(axis=1))
+    genuine = genuine[np.isfinite(genuine)]
+    cuts = np.unique(np.concatenate([genuine, impostor]))
+    g, i = np.sort(genuine), np.sort(impostor)
+    errors = np.searchsorted(g, cuts) + (len(i) - np.searchsorted(i, cuts))
+    return float(cuts[errors.argmin()])
@@ -0,0 +1,110 @@
+from functools import lru_cache
+import io, os
+import cv2
+import numpy as np
+from PIL import Image
+
+# scraped role folders are full of the same press shot at several sizes, and of
+# logos, placeholders and thumbnails with no usable face. these are dropped
+# before detection using a tiny decode of each file: junk by size, shape and
+# flatness, near-duplicates by perceptual hash (dHash and pHash must both
+# agree). after embedding, faces of one role that are almost the same vector
+# are collapsed as well
+MIN_BYTES = 2048
+MIN_SIDE = 64       # shorter side in pixels, a face in less is too small to train on
+MAX_ASPECT = 4.0    # banners and strips
+MIN_STD = 6.0       # grey level spread of a blank or single-colour image
+THUMB = 32
+
+def popcount(x):
+  return np.unpackbits(np.ascontiguousarray(x, np.uint64).view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+def bits_to_int(bits):
+  return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+# THUMB x THUMB greyscale, JPEGs are decoded straight at a reduced scale
+def thumbnail(raw):
+  im = Image.open(io.BytesIO(raw))
+  size = im.size
+  im.draft("L", (THUMB * 2, THUMB * 2))
+  gray = np.asarray(im.convert("L").resize((THUMB, THUMB), Image.BILINEAR), np.float32)
+  return size, gray
+
+# difference hash: is each pixel brighter than its right neighbour, on 9x8
+def dhash(gray):
+  small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+  return bits_to_int(small[:, 1:] > small[:, :-1])
+
+# perceptual hash: low 8x8 frequencies of the DCT against their median
+def phash(gray):
+  low = cv2.dct(gray)[:8, :8]
+  return bits_to_int(low > np.median(low.ravel()[1:]))
+
+# (reason, hashes) for one file; reason is None for an image worth embedding
+def inspect(raw):
+  if len(raw) < MIN_BYTES:
+    return "too_small", None
+  try:
+    (w, h), gray = thumbnail(raw)
+  except Exception:
+    return "undecodable", None
+  if min(w, h) < MIN_SIDE:
+    return "too_small", None
+  if max(w, h) / min(w, h) > MAX_ASPECT:
+    return "odd_shape", None
+  if gray.std() < MIN_STD:
+    return "blank", None
+  return None, (dhash(gray), phash(gray), w * h)
+
+# inspect() of a file, remembered until the file changes so a retrain over the
+# same folders doesn't decode every thumbnail again
+def inspect_file(path):
+  try:
+    st = os.stat(path)
+  except OSError:
+    return "undecodable", None
+  return inspect_cached(path, st.st_mtime_ns, st.st_size)
+
+@lru_cache(maxsize=65536)
+def inspect_cached(path, mtime_ns, size):
+  try:
+    with open(path, "rb") as fh:
+      return inspect(fh.read())
+  except OSError:
+    return "undecodable", None
+
+# splits one role's files into the ones to embed and {path: reason} for the
+# rest. of a group of near-duplicates the largest image is kept, the others
+# are within max_distance bits of it on both hashes
+def filter_images(paths, max_distance=6):
+  rejected, candidates = {}, []
+  for path in paths:
+    reason, hashes = inspect_file(path)
+    if reason is None:
+      candidates.append((path, hashes))
+    else:
+      rejected[path] = reason
+  candidates.sort(key=lambda c: -c[1][2])
+  d = np.array([h[0] for _, h in candidates], np.uint64)
+  p = np.array([h[1] for _, h in candidates], np.uint64)
+  near = ((popcount(d[:, None] ^ d[None]) <= max_distance) &
+          (popcount(p[:, None] ^ p[None]) <= max_distance)).reshape(len(d), len(d))
+  kept = np.zeros(len(candidates), bool)
+  for i, (path, _) in enumerate(candidates):
+    if near[i, kept].any():
+      rejected[path] = "duplicate"
+    else:
+      kept[i] = True
+  keep = {path for (path, _), k in zip(candidates, kept) if k}
+  return [path for path in paths if path in keep], rejected
+
+# keep mask over one role's embeddings (L2-normalised rows): a face is dropped
+# when it is at least max_similarity cosine to a face already kept
+def dedup_embeddings(X, max_similarity=0.97):
+  keep = np.zeros(len(X), bool)
+  if len(X) == 0:
+    return keep
+  sim = X @ X.T
+  for i in range(len(X)):
+    keep[i] = not (sim[i, keep] >= max_similarity).any()
+  return keep
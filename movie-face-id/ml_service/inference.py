@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, os, threading, time
+import face_pipeline
+from profiles import PREDICT_PROFILE
+from metrics import STAGE_SECONDS
+
+class Saturated(Exception):
+  pass
+
+class TimedOut(Exception):
+  pass
+
+# recognition runs on the micro-batcher's shared app, so a worker only detects
+def init_worker(threads, profile):
+  fa = face_pipeline.build_face_app(threads, profile, modules=["detection"])
+  face_pipeline.warm_up(fa)
+  face_pipeline.local.face_app = fa
+
+# cpu-bound inference runs here, off the event loop. each worker thread owns a
+# warmed detector whose onnx session gets cores/(workers + 1) threads, the
+# last share being the shared app's recognition pass, and which uses the given
+# profile (the fast one by default). at most
+# workers + max_queue calls are admitted, anything beyond that is rejected
+# straight away (the endpoint answers 429) instead of queueing without bound
+class InferencePool:
+  def __init__(self, workers=2, max_queue=16, timeout=30.0, profile=PREDICT_PROFILE):
+    self.workers = workers
+    self.max_queue = max_queue
+    self.timeout = timeout
+    self.threads = max(1, (os.cpu_count() or 1) // (workers + 1))
+    self.executor = ThreadPoolExecutor(workers, thread_name_prefix="infer",
+                                       initializer=init_worker, initargs=(self.threads, profile))
+    self.pending = 0
+    self.running = 0  # calls a worker is executing right now
+    self.lock = threading.Lock()
+
+  def release(self, _):
+    with self.lock:
+      self.pending -= 1
+
+  # time between submit and a worker picking the call up
+  def call(self, submitted, fn, args, timings):
+    waited = time.perf_counter() - submitted
+    STAGE_SECONDS.observe(waited, stage="queue_wait")
+    if timings is not None:
+      timings["queue_wait"] = round(waited * 1000, 3)
+    with self.lock:
+      self.running += 1
+    try:
+      return fn(*args)
+    finally:
+      with self.lock:
+        self.running -= 1
+
+  # raises Saturated when full and TimedOut when the call runs too long. a
+  # timed-out call still holds its slot until the thread finishes it
+  async def run(self, fn, *args, timings=None):
+    with self.lock:
+      if self.pending >= self.workers + self.max_queue:
+        raise Saturated()
+      self.pending += 1
+    fut = self.executor.submit(self.call, time.perf_counter(), fn, args, timings)
+    fut.add_done_callback(self.release)
+    try:
+      return await asyncio.wait_for(asyncio.wrap_future(fut), self.timeout)
+    except asyncio.TimeoutError:
+      raise TimedOut() from None
+
+  # start every worker (and its warm-up) now rather than on first request
+  def warm(self):
+    barrier = threading.Barrier(self.workers)
+    return [self.executor.submit(barrier.wait) for _ in range(self.workers)]
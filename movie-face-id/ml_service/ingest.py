@@ -0,0 +1,39 @@
+import asyncio
+from scrape import scrape_cast
+
+# scrape and embed at the same time: every image that lands on disk goes on a
+# queue and a small pool of workers runs embed(path) on it right away (embed
+# writes into the embedding cache), so the retrain that follows is all cache hits.
+# embed returns None for an image it chose not to embed
+async def ingest(actor_dict, movie_title, faces_dir, api_key, embed, workers=2, limit=40, **scrape_opts):
+  queue = asyncio.Queue()
+  stats = {"embedded": 0, "faces": 0, "skipped": 0, "errors": 0}
+
+  def on_progress(done, total, path, status):
+    if status == "ok":
+      queue.put_nowait(path)
+
+  async def worker():
+    while True:
+      path = await queue.get()
+      if path is None:
+        return
+      try:
+        embeddings = await asyncio.to_thread(embed, path)
+        if embeddings is None:
+          stats["skipped"] += 1
+          continue
+        stats["embedded"] += 1
+        stats["faces"] += len(embeddings)
+      except Exception:
+        stats["errors"] += 1
+
+  pool = [asyncio.create_task(worker()) for _ in range(workers)]
+  try:
+    scraped = await scrape_cast(actor_dict, movie_title, faces_dir, api_key, limit,
+                                on_progress=on_progress, **scrape_opts)
+  finally:
+    for _ in pool:
+      queue.put_nowait(None)
+    await asyncio.gather(*pool)
+  return scraped, stats
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading, time, uuid
+
+class Cancelled(Exception):
+  pass
+
+class Job:
+  def __init__(self, kind):
+    self.id = uuid.uuid4().hex
+    self.kind = kind
+    self.status = "queued"
+    self.progress = {}
+    self.result = None
+    self.error = None
+    self.created = time.time()
+    self.started = None
+    self.finished = None
+    self.cancel_event = threading.Event()
+
+  def update(self, **progress):
+    # called from the worker; doubles as the cancellation point
+    if self.cancel_event.is_set():
+      raise Cancelled()
+    self.progress.update(progress)
+
+  def to_dict(self):
+    return {"id": self.id, "kind": self.kind, "status": self.status, "progress": dict(self.progress),
+            "result": self.result, "error": self.error, "created": self.created,
+            "started": self.started, "finished": self.finished}
+
+# long-running work (training) runs here instead of inside the request.
+# one worker by default so two trains never race on the same model files
+class JobManager:
+  def __init__(self, workers=1, keep=100):
+    self.pool = ThreadPoolExecutor(workers, thread_name_prefix="job")
+    self.jobs = OrderedDict()
+    self.keep = keep
+    self.lock = threading.Lock()
+
+  def submit(self, kind, fn, *args, **kwargs):
+    job = Job(kind)
+    with self.lock:
+      self.jobs[job.id] = job
+      while len(self.jobs) > self.keep:
+        oldest = next(iter(self.jobs.values()))
+        if oldest.finished is None:
+          break
+        self.jobs.popitem(last=False)
+    self.pool.submit(self.run, job, fn, args, kwargs)
+    return job
+
+  def run(self, job, fn, args, kwargs):
+    if job.cancel_event.is_set():
+      job.status, job.finished = "cancelled", time.time()
+      return
+    job.status, job.started = "running", time.time()
+    try:
+      job.result = fn(job, *args, **kwargs)
+      job.status = "done"
+    except Cancelled:
+      job.status = "cancelled"
+    except Exception as e:
+      job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+    job.finished = time.time()
+
+  def get(self, job_id):
+    with self.lock:
+      return self.jobs.get(job_id)
+
+  def cancel(self, job_id):
+    job = self.get(job_id)
+    if job is not None and job.finished is None:
+      job.cancel_event.set()
+    return job
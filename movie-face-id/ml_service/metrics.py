@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+import bisect, threading, time
+
+# a small stand-in for prometheus_client: counters, gauges and histograms with
+# labels, rendered in the prometheus text format by GET /metrics
+
+METRICS = []
+
+def label_str(labels, extra=()):
+  pairs = list(labels) + list(extra)
+  if not pairs:
+    return ""
+  return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Counter:
+  kind = "counter"
+
+  def __init__(self, name, help):
+    self.name, self.help = name, help
+    self.values = {}
+    self.lock = threading.Lock()
+    METRICS.append(self)
+
+  def inc(self, n=1, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + n
+
+  def samples(self):
+    with self.lock:
+      return [f"{self.name}{label_str(k)} {v}" for k, v in sorted(self.values.items())]
+
+# value read at scrape time, for things that already keep their own count
+class Gauge:
+  kind = "gauge"
+
+  def __init__(self, name, help, fn):
+    self.name, self.help, self.fn = name, help, fn
+    METRICS.append(self)
+
+  def samples(self):
+    return [f"{self.name} {self.fn()}"]
+
+class Histogram:
+  kind = "histogram"
+
+  def __init__(self, name, help, buckets):
+    self.name, self.help = name, help
+    self.buckets = sorted(buckets)
+    self.values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+    self.lock = threading.Lock()
+    METRICS.append(self)
+
+  def observe(self, value, **labels):
+    key = tuple(sorted(labels.items()))
+    i = bisect.bisect_left(self.buckets, value)
+    with self.lock:
+      row = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+      row[i] += 1
+      row[-1] += value
+
+  def samples(self):
+    out = []
+    with self.lock:
+      rows = sorted((k, list(v)) for k, v in self.values.items())
+    for key, row in rows:
+      total = 0
+      for le, n in zip(self.buckets + ["+Inf"], row[:-1]):
+        total += n
+        out.append(f"{self.name}_bucket{label_str(key, [('le', le)])} {total}")
+      out.append(f"{self.name}_sum{label_str(key)} {row[-1]}")
+      out.append(f"{self.name}_count{label_str(key)} {total}")
+    return out
+
+def render():
+  lines = []
+  for m in METRICS:
+    lines += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.kind}", *m.samples()]
+  return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram("face_id_stage_seconds", "time spent per pipeline stage",
+                          [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60])
+FACES_PER_IMAGE = Histogram("face_id_faces_per_image", "faces detected per image", [0, 1, 2, 3, 5, 8, 13, 21])
+IMAGES_REJECTED = Counter("face_id_training_images_rejected_total", "training images skipped, by reason")
+BATCH_FACES = Histogram("face_id_recognition_batch_faces", "face crops per recognition pass", [1, 2, 4, 8, 16, 32, 64])
+
+# times the block into the stage histogram and, when the caller passed a
+# timings dict (the per-request debug block), adds the milliseconds there too
+@contextmanager
+def timed(stage, timings=None):
+  t = time.perf_counter()
+  try:
+    yield
+  finally:
+    elapsed = time.perf_counter() - t
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    if timings is not None:
+      timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 3)
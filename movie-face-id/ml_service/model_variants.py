@@ -0,0 +1,189 @@
+import argparse, json, os, shutil, sys, tempfile, time
+import cv2
+import numpy as np
+import onnxruntime
+from insightface.app import FaceAnalysis
+from insightface.model_zoo import get_model
+import face_pipeline
+from face_pipeline import detect, align, embed_crops
+from embed_cache import EMBED_DIM
+from gallery import EmbeddingIndex, UNKNOWN
+from profiles import MODULES, TRAIN_PROFILE, get_profile
+
+# insightface looks model packs up as <root>/models/<name>, so a variant is just
+# another pack next to the stock one and MODEL_VARIANT=<variant> serves it
+ROOT = "models"
+BASE = "auraface"
+VARIANTS = ("int8", "opt")
+
+def pack_dir(name, root=ROOT):
+  return os.path.join(root, "models", name)
+
+# offline graph optimisation (constant folding, node fusions). the extended
+# level bakes in CPU-specific fusions, which is fine since CPU is all we run on
+def optimize(src, dst):
+  opts = onnxruntime.SessionOptions()
+  opts.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+  opts.optimized_model_filepath = dst
+  onnxruntime.InferenceSession(src, sess_options=opts, providers=["CPUExecutionProvider"])
+
+# dynamic INT8: weights are quantized ahead of time, activations per batch, so
+# no calibration set is needed. uint8 weights because the CPU ConvInteger
+# kernel has no int8 x int8 variant
+def quantize(src, dst):
+  from onnxruntime.quantization import QuantType, quantize_dynamic
+  from onnxruntime.quantization.shape_inference import quant_pre_process
+  with tempfile.TemporaryDirectory() as tmp:
+    prepped = os.path.join(tmp, "prepped.onnx")
+    quant_pre_process(src, prepped, skip_symbolic_shape=True)
+    quantize_dynamic(prepped, dst, weight_type=QuantType.QUInt8)
+
+# writes models/models/<base>-<variant>/ with every onnx file of the base pack
+# rewritten; models whose task is not in tasks are copied unchanged.
+# insightface guesses the recognition model's input normalisation from its
+# first node names, a rewrite that changes that guess would silently skew every
+# embedding, so that is checked before the pack is kept
+def build_variant(variant, base=BASE, root=ROOT, tasks=MODULES):
+  convert = {"int8": quantize, "opt": optimize}[variant]
+  src_dir, dst_dir = pack_dir(base, root), pack_dir(f"{base}-{variant}", root)
+  os.makedirs(dst_dir, exist_ok=True)
+  written = {}
+  for fn in sorted(os.listdir(src_dir)):
+    if not fn.endswith(".onnx"):
+      continue
+    src, dst = os.path.join(src_dir, fn), os.path.join(dst_dir, fn)
+    before = get_model(src, providers=["CPUExecutionProvider"])
+    if before is None or before.taskname not in tasks:
+      shutil.copyfile(src, dst)
+      continue
+    convert(src, dst)
+    after = get_model(dst, providers=["CPUExecutionProvider"])
+    if before.taskname == "recognition" and (before.input_mean, before.input_std) != (after.input_mean, after.input_std):
+      os.remove(dst)
+      raise RuntimeError(f"{fn}: {variant} rewrite changed the input normalisation insightface infers")
+    written[fn] = {"task": before.taskname, "mb_before": round(os.path.getsize(src) / 2**20, 1),
+                   "mb_after": round(os.path.getsize(dst) / 2**20, 1)}
+  return dst_dir, written
+
+def labeled_images(faces_dir):
+  for role in sorted(os.listdir(faces_dir)):
+    role_dir = os.path.join(faces_dir, role)
+    if not os.path.isdir(role_dir):
+      continue
+    for fn in sorted(os.listdir(role_dir)):
+      if fn.lower().endswith((".jpg", ".jpeg", ".png")):
+        yield os.path.join(role_dir, fn), role
+
+# runs one pack over the labeled set the way training does (images with
+# exactly one face) and times detection and recognition separately
+def embed_set(name, items, profile=TRAIN_PROFILE, root=ROOT):
+  fa = FaceAnalysis(name=name, root=root, providers=["CPUExecutionProvider"], allowed_modules=MODULES)
+  fa.prepare(ctx_id=0, **get_profile(profile))
+  face_pipeline.local.face_app = fa
+  face_pipeline.warm_up(fa)
+  found, det_ms, rec_ms = {}, [], []
+  try:
+    for path, role in items:
+      img = cv2.imread(path)
+      if img is None:
+        continue
+      t0 = time.perf_counter()
+      _, _, kpss = detect(img)
+      t1 = time.perf_counter()
+      embeddings = embed_crops(align(img, kpss))
+      t2 = time.perf_counter()
+      det_ms.append((t1 - t0) * 1000)
+      if len(embeddings):
+        rec_ms.append((t2 - t1) * 1000 / len(embeddings))
+      if len(embeddings) == 1:
+        found[path] = (embeddings[0], role)
+  finally:
+    face_pipeline.local.face_app = None
+  return found, np.array(det_ms), np.array(rec_ms)
+
+# deterministic splits: every holdout-th role (sorted) plays the people who are
+# not in the cast, and every fifth image of the others is a query
+def split(found, holdout):
+  paths = sorted(found)
+  roles = sorted({found[p][1] for p in paths})
+  unknown = set(roles[holdout - 1::holdout]) if holdout else set()
+  train, test, strangers, seen = [], [], [], {}
+  for p in paths:
+    role = found[p][1]
+    if role in unknown:
+      strangers.append(p)
+      continue
+    seen[role] = seen.get(role, 0) + 1
+    (test if seen[role] % 5 == 0 else train).append(p)
+  return train, test, strangers
+
+def stack(found, paths):
+  return (np.array([found[p][0] for p in paths]).reshape(-1, EMBED_DIM),
+          np.array([found[p][1] for p in paths]))
+
+def accuracy(found, holdout):
+  train, test, strangers = split(found, holdout)
+  X, y = stack(found, train)
+  Xq, yq = stack(found, test)
+  Xs, _ = stack(found, strangers)
+  if len(np.unique(y)) < 2 or not len(Xq):
+    return {"top1": None, "open_set_known": None, "open_set_rejected": None}
+  closed = EmbeddingIndex(threshold=-1.0).fit(X, y)
+  opened = EmbeddingIndex().fit(X, y)
+  res = {"top1": closed.score(Xq, yq), "open_set_known": opened.score(Xq, yq),
+         "open_set_rejected": float(np.mean(opened.predict(Xs) == UNKNOWN)) if len(Xs) else None,
+         "threshold": opened.threshold}
+  return {k: round(v, 4) if v is not None else None for k, v in res.items()}
+
+def percentiles(ms):
+  if not len(ms):
+    return {"p50": None, "p90": None}
+  return {"p50": round(float(np.percentile(ms, 50)), 2), "p90": round(float(np.percentile(ms, 90)), 2)}
+
+# latency and accuracy of each pack on the same labeled faces folder; the
+# first pack is the reference every other one's embeddings are compared to
+def compare(names, faces_dir, profile=TRAIN_PROFILE, holdout=4, root=ROOT):
+  items = list(labeled_images(faces_dir))
+  report, ref = [], None
+  for name in names:
+    found, det_ms, rec_ms = embed_set(name, items, profile, root)
+    row = {"model": name, "images": len(items), "one_face": len(found),
+           "detect_ms": percentiles(det_ms), "embed_ms_per_face": percentiles(rec_ms), **accuracy(found, holdout)}
+    if ref is None:
+      ref = found
+    else:
+      shared = [p for p in found if p in ref]
+      row["cosine_to_ref"] = round(float(np.mean([found[p][0] @ ref[p][0] for p in shared])), 4) if shared else None
+      row["same_faces_as_ref"] = round(len(shared) / max(1, len(ref)), 4)
+    report.append(row)
+  return report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="build quantized / optimized model packs and compare them against fp32")
+  sub = parser.add_subparsers(dest="cmd", required=True)
+  build = sub.add_parser("build", help=f"write models/models/{BASE}-<variant>")
+  build.add_argument("variants", nargs="+", choices=VARIANTS)
+  build.add_argument("--tasks", default=",".join(MODULES), help="comma separated tasks to rewrite, others are copied")
+  cmp = sub.add_parser("compare", help="latency and top-1 / open-set accuracy per model pack")
+  cmp.add_argument("faces", help="labeled faces folder, one sub-folder per role")
+  cmp.add_argument("--models", nargs="+", default=[BASE] + [f"{BASE}-{v}" for v in VARIANTS],
+                   help="model packs under models/models, the first is the reference")
+  cmp.add_argument("--profile", default=TRAIN_PROFILE)
+  cmp.add_argument("--holdout", type=int, default=4, help="every Nth role is treated as unknown (0 = none)")
+  cmp.add_argument("--json", default=None, help="also write the report here")
+  args = parser.parse_args()
+
+  if args.cmd == "build":
+    for variant in args.variants:
+      out, written = build_variant(variant, tasks=args.tasks.split(","))
+      print(out, json.dumps(written, indent=2))
+  else:
+    names = [m for m in args.models if os.path.isdir(pack_dir(m))]
+    for m in set(args.models) - set(names):
+      print(f"skipping {m}: no pack at {pack_dir(m)}", file=sys.stderr)
+    report = compare(names, args.faces, args.profile, args.holdout)
+    for row in report:
+      print(json.dumps(row))
+    if args.json:
+      with open(args.json, "w") as fh:
+        json.dump(report, fh, indent=2)
@@ -0,0 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+import os
+import cv2
+import numpy as np
+import onnxruntime
+from insightface.app import FaceAnalysis
+from embed_cache import EMBED_DIM
+from profiles import MODULES, TRAIN_PROFILE, get_profile
+
+# every face in one image file: embeddings (n, 512), boxes (n, 4), scores (n,)
+def detect_file(face_app, path):
+  img = cv2.imread(path)
+  faces = face_app.get(img) if img is not None else []
+  return (np.asarray([f.normed_embedding for f in faces], np.float32).reshape(-1, EMBED_DIM),
+          np.asarray([f.bbox for f in faces], np.float32).reshape(-1, 4),
+          np.asarray([f.det_score for f in faces], np.float32).reshape(-1))
+
+# insightface builds its onnx sessions with default options (one intra-op thread
+# per core), so with several worker processes every session is rebuilt with a
+# fixed thread count to keep workers * threads <= cores
+def limit_threads(face_app, threads):
+  opts = onnxruntime.SessionOptions()
+  opts.intra_op_num_threads = threads
+  opts.inter_op_num_threads = 1
+  for model in face_app.models.values():
+    model.session = onnxruntime.InferenceSession(model.model_file, sess_options=opts,
+                                                 providers=["CPUExecutionProvider"])
+
+worker_app = None
+
+def init_worker(model_name, root, threads, profile):
+  global worker_app
+  cv2.setNumThreads(1)
+  worker_app = FaceAnalysis(name=model_name, root=root, providers=["CPUExecutionProvider"],
+                            allowed_modules=MODULES)
+  limit_threads(worker_app, threads)
+  worker_app.prepare(ctx_id=0, **get_profile(profile))
+
+def worker_detect(path):
+  return detect_file(worker_app, path)
+
+# shards paths across a pool of processes, each holding its own FaceAnalysis.
+# yields results in the order of paths no matter which worker ran them; if the
+# consumer stops early (job cancelled) the queued work is dropped
+def detect_files_parallel(paths, model_name, root="models", workers=None, profile=TRAIN_PROFILE):
+  workers = workers or default_workers()
+  threads = max(1, (os.cpu_count() or 1) // workers)
+  chunksize = max(1, len(paths) // (workers * 8))
+  # spawn, not fork: onnxruntime thread pools do not survive a fork
+  pool = ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"),
+                             initializer=init_worker, initargs=(model_name, root, threads, profile))
+  try:
+    yield from pool.map(worker_detect, paths, chunksize=chunksize)
+  finally:
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def default_workers():
+  return max(1, (os.cpu_count() or 1) // 4)
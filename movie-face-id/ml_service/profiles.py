@@ -0,0 +1,36 @@
+import os
+
+# the pipeline only ever reads boxes, landmarks and embeddings, so any other
+# heads in the model pack (3d landmarks, gender/age) are never loaded
+MODULES = ["detection", "recognition"]
+
+# detector input size and score threshold. "fast" serves /predict, where the
+# faces in a screenshot are large; "thorough" is for training images, where a
+# missed face costs a training example
+PROFILES = {
+  "fast": {"det_size": (480, 480), "det_thresh": 0.5},
+  "thorough": {"det_size": (640, 640), "det_thresh": 0.5},
+}
+
+PREDICT_PROFILE = os.environ.get("PREDICT_PROFILE", "fast")
+TRAIN_PROFILE = os.environ.get("TRAIN_PROFILE", "thorough")
+
+# a profile's settings, FAST_DET_SIZE=320 / FAST_DET_THRESH=0.6 (and the
+# THOROUGH_ equivalents) override the defaults above
+def get_profile(name):
+  if name not in PROFILES:
+    raise ValueError(f"unknown detection profile '{name}'")
+  profile = dict(PROFILES[name])
+  size = os.environ.get(f"{name.upper()}_DET_SIZE")
+  thresh = os.environ.get(f"{name.upper()}_DET_THRESH")
+  if size:
+    profile["det_size"] = (int(size), int(size))
+  if thresh:
+    profile["det_thresh"] = float(thresh)
+  return profile
+
+# short name for a profile's settings, cached detections are kept per tag so
+# changing the training profile never serves boxes found with the old one
+def profile_tag(name):
+  profile = get_profile(name)
+  return "{}x{}-{:g}".format(*profile["det_size"], profile["det_thresh"])
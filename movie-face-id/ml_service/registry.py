@@ -0,0 +1,97 @@
+from collections import OrderedDict
+import os, threading
+import joblib
+import numpy as np
+from embedding_store import EmbeddingStore
+from gallery import EmbeddingIndex
+from metrics import timed
+
+# mapped arrays live in the page cache rather than the heap, they don't count
+def model_nbytes(model):
+  return sum(v.nbytes for v in vars(model).values()
+             if isinstance(v, np.ndarray) and not isinstance(v, np.memmap))
+
+# the embedding store a model was trained from sits next to its model file
+def store_dir(model_path):
+  return os.path.join(os.path.dirname(model_path), "store")
+
+# the classifier saved at path. an EmbeddingIndex gets its gallery back from
+# the store generation it was trained on, mapped rather than read in
+def load_model(path):
+  saved = joblib.load(path)
+  model = saved["clf"]
+  if isinstance(model, EmbeddingIndex):
+    model.attach(EmbeddingStore(store_dir(path)).open(saved.get("store"))["X"])
+  return model
+
+# one trained model per movie (keyed by TMDB id), loaded on first use and kept
+# in an LRU bounded by the size of the arrays each model holds. movie_id None is
+# the original single-movie layout (faces/ and models/clf.joblib)
+class ModelRegistry:
+  def __init__(self, base_dir, max_bytes):
+    self.base_dir = base_dir
+    self.max_bytes = max_bytes
+    self.models = OrderedDict()
+    self.nbytes = 0
+    self.puts = {}  # movie_id -> number of put() calls, to spot one during a load
+    self.lock = threading.Lock()
+
+  def movie_dir(self, movie_id):
+    if movie_id is None:
+      return self.base_dir
+    return os.path.join(self.base_dir, "movies", str(int(movie_id)))
+
+  def faces_dir(self, movie_id):
+    return os.path.join(self.movie_dir(movie_id), "faces")
+
+  def model_path(self, movie_id):
+    return os.path.join(self.movie_dir(movie_id), "models", "clf.joblib")
+
+  def store(self, movie_id):
+    return EmbeddingStore(store_dir(self.model_path(movie_id)))
+
+  # changes whenever a train writes a new model file, None if there is none
+  def version(self, movie_id):
+    try:
+      return os.stat(self.model_path(movie_id)).st_mtime_ns
+    except FileNotFoundError:
+      return None
+
+  def get(self, movie_id):
+    with self.lock:
+      if movie_id in self.models:
+        self.models.move_to_end(movie_id)
+        return self.models[movie_id]
+      seen = self.puts.get(movie_id, 0)
+    path = self.model_path(movie_id)
+    if not os.path.exists(path):
+      return None
+    with timed("model_load"):
+      model = load_model(path)
+    with self.lock:
+      # a train put a newer model while this one loaded: that one wins, and
+      # what was just read may be the file it replaced, so it isn't kept
+      if self.puts.get(movie_id, 0) != seen:
+        return self.models.get(movie_id, model)
+      self._put(movie_id, model)
+    return model
+
+  def put(self, movie_id, model):
+    with self.lock:
+      self.puts[movie_id] = self.puts.get(movie_id, 0) + 1
+      self._put(movie_id, model)
+
+  def _put(self, movie_id, model):
+    old = self.models.pop(movie_id, None)
+    if old is not None:
+      self.nbytes -= model_nbytes(old)
+    self.models[movie_id] = model
+    self.nbytes += model_nbytes(model)
+    # evict least recently used, but always keep the model just added
+    while self.nbytes > self.max_bytes and len(self.models) > 1:
+      _, evicted = self.models.popitem(last=False)
+      self.nbytes -= model_nbytes(evicted)
+
+  def loaded(self):
+    with self.lock:
+      return list(self.models)
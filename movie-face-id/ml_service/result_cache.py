@@ -0,0 +1,64 @@
+from collections import OrderedDict
+import json, os, shutil, threading
+
+# /predict answers keyed by movie, model version and image content hash. the
+# in-memory part is an LRU of max_entries; with root set every answer is also
+# written to root/<movie>/<version>/<key>.json so it survives a restart.
+# a new model gets a new version, so stale answers can never be returned, and
+# invalidate() drops the old ones to free the space straight away
+class ResultCache:
+  def __init__(self, max_entries=1024, root=None):
+    self.max_entries = max_entries
+    self.root = root
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+
+  def _movie_dir(self, movie_id):
+    return os.path.join(self.root, "default" if movie_id is None else str(int(movie_id)))
+
+  def _path(self, movie_id, version, key):
+    return os.path.join(self._movie_dir(movie_id), str(version), key + ".json")
+
+  def get(self, movie_id, version, key):
+    k = (movie_id, version, key)
+    with self.lock:
+      if k in self.entries:
+        self.entries.move_to_end(k)
+        return self.entries[k]
+    if self.root is None:
+      return None
+    try:
+      with open(self._path(movie_id, version, key)) as fh:
+        results = json.load(fh)
+    except (OSError, ValueError):
+      return None
+    self._remember(k, results)
+    return results
+
+  def put(self, movie_id, version, key, results):
+    self._remember((movie_id, version, key), results)
+    if self.root is not None:
+      path = self._path(movie_id, version, key)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+      with open(tmp, "w") as fh:
+        json.dump(results, fh)
+      os.replace(tmp, path)
+
+  def _remember(self, k, results):
+    with self.lock:
+      self.entries[k] = results
+      self.entries.move_to_end(k)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  # every answer for this movie, in memory and on disk
+  def invalidate(self, movie_id):
+    with self.lock:
+      for k in [k for k in self.entries if k[0] == movie_id]:
+        del self.entries[k]
+    if self.root is not None:
+      shutil.rmtree(self._movie_dir(movie_id), ignore_errors=True)
+
+  def __len__(self):
+    return len(self.entries)
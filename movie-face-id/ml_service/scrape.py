@@ -0,0 +1,161 @@
+import argparse, asyncio, json, os, random, sys
+from urllib.parse import urlsplit
+import cv2
+import httpx
+
+SEARCH_URL = "https://serpapi.com/search.json"
+MAX_IMAGE_BYTES = 15 * 2**20
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# same query the gateway and notebook have always used, it gives the best hits
+def search_query(actor, role, movie_title):
+  return f"{actor} {role} {movie_title} face"
+
+class RetryableStatus(Exception):
+  pass
+
+# bounded-concurrency image downloader: one pooled client, a global cap plus a
+# per-host cap, retries with backoff, bytes streamed straight into the target
+# file and every file checked to decode as an image before it is kept
+class Downloader:
+  def __init__(self, concurrency=32, per_host=4, timeout=10.0, retries=2, on_progress=None):
+    self.client = httpx.AsyncClient(
+      timeout=httpx.Timeout(timeout),
+      limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+      follow_redirects=True,
+      headers={"User-Agent": "Mozilla/5.0 (Prosopagknows image fetcher)"},
+    )
+    self.slots = asyncio.Semaphore(concurrency)
+    self.per_host = per_host
+    self.hosts = {}
+    self.retries = retries
+    self.on_progress = on_progress
+    self.done = 0
+    self.total = 0
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc):
+    await self.client.aclose()
+
+  def host_slot(self, url):
+    host = urlsplit(url).netloc
+    if host not in self.hosts:
+      self.hosts[host] = asyncio.Semaphore(self.per_host)
+    return self.hosts[host]
+
+  async def get_json(self, url, params):
+    for attempt in range(self.retries + 1):
+      try:
+        r = await self.client.get(url, params=params)
+        if r.status_code in RETRY_STATUS and attempt < self.retries:
+          await asyncio.sleep(0.5 * 2**attempt)
+          continue
+        r.raise_for_status()
+        return r.json()
+      except httpx.TransportError:
+        if attempt == self.retries:
+          raise
+        await asyncio.sleep(0.5 * 2**attempt)
+
+  async def fetch(self, url, path):
+    async with self.host_slot(url), self.slots:
+      for attempt in range(self.retries + 1):
+        try:
+          ok = await self.stream_to(url, path)
+          break
+        except (httpx.TransportError, RetryableStatus):
+          ok = False
+          if attempt < self.retries:
+            await asyncio.sleep(0.5 * 2**attempt + random.random() * 0.1)
+        except (httpx.HTTPError, httpx.InvalidURL):
+          # redirect loops, bodies that don't decode, malformed urls: another
+          # try won't help, and one bad search hit must not fail the whole role
+          ok = False
+          break
+    # decoding is cpu work, keep it off the event loop
+    if ok and await asyncio.to_thread(is_image, path):
+      status = "ok"
+    else:
+      status = "invalid" if ok else "failed"
+      if os.path.exists(path):
+        os.remove(path)
+    self.done += 1
+    if self.on_progress:
+      self.on_progress(self.done, self.total, path, status)
+    return status
+
+  async def stream_to(self, url, path):
+    tmp = path + ".part"
+    try:
+      async with self.client.stream("GET", url) as r:
+        if r.status_code in RETRY_STATUS:
+          raise RetryableStatus(r.status_code)
+        if r.status_code != 200:
+          return False
+        size = 0
+        with open(tmp, "wb") as fh:
+          async for chunk in r.aiter_bytes():
+            size += len(chunk)
+            if size > MAX_IMAGE_BYTES:
+              return False
+            fh.write(chunk)
+      if size == 0:
+        return False
+      os.replace(tmp, path)
+      return True
+    finally:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+
+def is_image(path):
+  # a reduced decode is enough to prove the file is a real image
+  return cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4) is not None
+
+async def scrape_role(dl, query, save_dir, limit, api_key, search_url):
+  os.makedirs(save_dir, exist_ok=True)
+  data = await dl.get_json(search_url, {"q": query, "tbm": "isch", "api_key": api_key})
+  urls = [im.get("original") or im.get("thumbnail") for im in (data or {}).get("images_results", [])[:limit]]
+  urls = [u for u in urls if u]
+  dl.total += len(urls)
+  statuses = await asyncio.gather(*(
+    dl.fetch(url, os.path.join(save_dir, f"{i+1}.jpg")) for i, url in enumerate(urls)
+  ))
+  return {"downloaded": statuses.count("ok"), "failed": statuses.count("failed"), "invalid": statuses.count("invalid")}
+
+# actor_dict = {"Actor Name": "Role", ...}, images land in faces_dir/<role>/<n>.jpg
+async def scrape_cast(actor_dict, movie_title, faces_dir, api_key, limit=40, search_url=SEARCH_URL,
+                      skip_existing=False, **downloader_opts):
+  async with Downloader(**downloader_opts) as dl:
+    roles, jobs = [], []
+    for actor, role in actor_dict.items():
+      save_dir = os.path.join(faces_dir, role)
+      if skip_existing and os.path.isdir(save_dir) and os.listdir(save_dir):
+        continue
+      roles.append(role)
+      jobs.append(scrape_role(dl, search_query(actor, role, movie_title), save_dir, limit, api_key, search_url))
+    done = await asyncio.gather(*jobs, return_exceptions=True)
+  return {role: ({"error": str(r)} if isinstance(r, Exception) else r) for role, r in zip(roles, done)}
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="download search images for every cast member")
+  parser.add_argument("cast", help='json file of {"Actor Name": "Role"}')
+  parser.add_argument("--movie", required=True, help="movie title used in the search query")
+  parser.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "faces"))
+  parser.add_argument("--limit", type=int, default=40)
+  parser.add_argument("--api-key", default=os.environ.get("SERPAPI_KEY", ""))
+  parser.add_argument("--search-url", default=SEARCH_URL)
+  parser.add_argument("--concurrency", type=int, default=32)
+  parser.add_argument("--per-host", type=int, default=4)
+  parser.add_argument("--skip-existing", action="store_true")
+  args = parser.parse_args()
+
+  with open(args.cast) as fh:
+    cast = json.load(fh)
+  progress = lambda done, total, path, status: print(f"\r{done}/{total} {status:8s} {path}", end="", file=sys.stderr)
+  results = asyncio.run(scrape_cast(cast, args.movie, args.out, args.api_key, args.limit, args.search_url,
+                                    args.skip_existing, concurrency=args.concurrency, per_host=args.per_host,
+                                    on_progress=progress))
+  print(file=sys.stderr)
+  print(json.dumps(results, indent=2))
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from assign import assign_faces, role_prototypes
+from gallery import normalize
+
+# the per-image loop assign_faces replaced, kept here as the reference
+def old_assign(groups, roles, protos, min_similarity=0.3, min_margin=0.1):
+  picks, confidence = [], []
+  for faces, role in zip(groups, roles):
+    sims = faces @ protos.get(role, np.zeros(faces.shape[1], np.float32))
+    order = np.argsort(-sims, kind="stable")
+    best = order[0]
+    second = sims[order[1]] if len(order) > 1 else -1.0
+    ok = role in protos and sims[best] >= min_similarity and sims[best] - second >= min_margin
+    picks.append(best if ok else -1)
+    confidence.append(sims[best])
+  return np.array(picks), np.array(confidence, np.float32)
+
+def scene(seed, images=40, d=12):
+  rng = np.random.default_rng(seed)
+  roles = [f"role{i}" for i in range(5)]
+  single = normalize(rng.normal(size=(60, d)))
+  single_y = np.array([roles[i % 4] for i in range(60)])  # role4 has no single-face images
+  protos = role_prototypes(single, single_y)
+  groups = [normalize(rng.normal(size=(rng.integers(1, 6), d))) for _ in range(images)]
+  # plant the role's own face in some images, sometimes barely ahead of the next
+  for g, role in zip(groups, roles * images):
+    if role in protos and rng.random() < 0.6:
+      face = protos[role] + rng.normal(scale=rng.choice([0.1, 1.0]), size=d)
+      g[rng.integers(len(g))] = face / np.linalg.norm(face)
+  return groups, [roles[i % 5] for i in range(images)], protos
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_per_image_loop(seed):
+  groups, roles, protos = scene(seed)
+  picks, confidence = assign_faces(groups, roles, protos)
+  want_picks, want_confidence = old_assign(groups, roles, protos)
+  assert picks.tolist() == want_picks.tolist()
+  np.testing.assert_allclose(confidence, want_confidence, atol=1e-6)
+  assert (picks >= 0).any() and (picks == -1).any()
+
+def test_margin_and_missing_prototype():
+  protos = {"a": np.array([1.0, 0.0], np.float32)}
+  groups = [np.array([[0.9, 0.1], [0.85, 0.2]], np.float32),  # too close to call
+            np.array([[0.1, 1.0], [0.9, 0.1]], np.float32),   # clear pick, second face
+            np.array([[1.0, 0.0]], np.float32)]               # no prototype for "b"
+  picks, _ = assign_faces(groups, ["a", "a", "b"], protos)
+  assert picks.tolist() == [-1, 1, -1]
+
+def test_no_groups():
+  picks, confidence = assign_faces([], [], {})
+  assert picks.shape == confidence.shape == (0,)
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading, time
+import numpy as np
+import pytest
+import batching
+from batching import MicroBatcher
+
+# crops are stood in for by their own embeddings, so no face model is needed
+@pytest.fixture(autouse=True)
+def fake_embed(monkeypatch):
+  calls = []
+  def embed(crops):
+    calls.append(len(crops))
+    return np.array(crops, np.float32).reshape(len(crops), -1)
+  monkeypatch.setattr(batching, "embed_crops", embed)
+  return calls
+
+# names a face by its value and the classifier that saw it
+class Tagger:
+  def __init__(self, tag):
+    self.tag = tag
+
+  def predict(self, E):
+    return np.array([f"{self.tag}{int(e[0])}" for e in E], dtype=object)
+
+class Broken:
+  def predict(self, E):
+    raise RuntimeError("no model")
+
+def test_concurrent_callers_get_their_own_names(fake_embed):
+  batcher = MicroBatcher(max_faces=16, max_wait=0.02)
+  clfs = [Tagger("a"), Tagger("b")]
+  def call(i):
+    faces = [[i * 100 + j] for j in range(i % 4 + 1)]
+    return batcher.classify(clfs[i % 2], faces)
+  with ThreadPoolExecutor(8) as pool:
+    results = list(pool.map(call, range(40)))
+  for i, names in enumerate(results):
+    assert names == [f"{'ab'[i % 2]}{i * 100 + j}" for j in range(i % 4 + 1)]
+  # some requests shared a recognition pass
+  assert len(fake_embed) < 40 and sum(fake_embed) == sum(i % 4 + 1 for i in range(40))
+
+def test_batch_closes_once_every_caller_is_in(fake_embed):
+  batcher = MicroBatcher(max_faces=32, max_wait=5.0, active=lambda: 1)
+  t = time.perf_counter()
+  assert batcher.classify(Tagger("a"), [[1], [2]]) == ["a1", "a2"]
+  assert time.perf_counter() - t < 1.0
+
+def test_no_crops_skips_the_batch(fake_embed):
+  assert MicroBatcher().classify(Tagger("a"), []) == []
+  assert fake_embed == []
+
+# a classifier that raises must not leave anyone in its batch waiting
+def test_a_failing_classifier_never_strands_its_batch(fake_embed):
+  batcher = MicroBatcher(max_faces=32, max_wait=0.2, active=lambda: 2)
+  barrier = threading.Barrier(2)
+  def call(clf):
+    barrier.wait()
+    try:
+      return batcher.classify(clf, [[7]])
+    except RuntimeError as e:
+      return str(e)
+  with ThreadPoolExecutor(2) as pool:
+    ok, broken = pool.map(call, [Tagger("a"), Broken()])
+  assert broken == "no model"
+  assert ok in (["a7"], "no model")
@@ -0,0 +1,66 @@
+import random
+import pytest
+from cast import select_cast, select_many, title_case
+
+# the per-movie loop select_cast replaced, kept here as the reference
+def old_main_cast(cast, always=5):
+  cast = sorted(cast, key=lambda c: c.get("order") if c.get("order") is not None else 999)
+  total = len(cast)
+  cutoffs = [always]
+  for frac in (0.10, 0.30, 0.60):
+    cutoffs.append(max(int(total * frac), cutoffs[-1]))
+  floors = [None, 2.0, 2.2, 2.5]
+  main = {}
+  for i, c in enumerate(cast[:cutoffs[-1]]):
+    character = (c.get("character") or "").lower()
+    if ("uncredited" in character or "voice" in character or "the ring" in character
+        or len(character) <= 1 or "#" in character):
+      continue
+    band = next(b for b, cut in enumerate(cutoffs) if i < cut)
+    if floors[band] is None or (c.get("popularity") or 0) >= floors[band]:
+      main[c["name"]] = title_case(character)
+  return main
+
+def person(i, character, **fields):
+  return {"name": f"Actor {i}", "character": character, "order": i, "popularity": 5.0, **fields}
+
+TRICKY = {
+  "missing order": [person(0, "Hero"), person(1, "Villain", order=None),
+                    {"name": "No Order", "character": "Sidekick", "popularity": 9.0}, person(3, "Mentor")],
+  "none popularity": [person(i, f"Role {i}", popularity=None) for i in range(12)],
+  "skipped roles": [person(0, "Guard #2"), person(1, "Narrator (voice)"), person(2, "Bartender (uncredited)"),
+                    person(3, "The Ring"), person(4, "X"), person(5, ""), person(6, None), person(7, "Frodo")],
+  "five or fewer": [person(i, f"Role {i}", popularity=0.1) for i in range(5)],
+  "one": [person(0, "Lonely")],
+  "empty": [],
+  "tied order": [person(1, "First", name="A"), person(1, "Second", name="B"), person(0, "Zeroth"),
+                 person(1, "Third", name="C")] + [person(i, f"Role {i}", popularity=2.1) for i in range(2, 12)],
+  "band floors": [person(i, f"Role {i}", popularity=p) for i, p in
+                  enumerate([0, 0, 0, 0, 0, 1.9, 2.0, 2.1, 2.2, 2.4, 2.5, 3.0] * 3)],
+}
+
+@pytest.mark.parametrize("name", TRICKY)
+def test_main_matches_old_loop(name):
+  cast = TRICKY[name]
+  assert select_cast(cast)["main"] == old_main_cast(cast)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_casts_match_old_loop(seed):
+  rng = random.Random(seed)
+  characters = ["Hero", "Guard #1", "Himself (voice)", "Extra (uncredited)", "A", "", None, "Dr. Jones", "the ring"]
+  cast = []
+  for i in range(rng.randint(0, 80)):
+    c = {"name": f"Actor {i}", "character": rng.choice(characters) if rng.random() < 0.3 else f"Role {i}"}
+    if rng.random() < 0.9:
+      c["order"] = rng.choice([i, i, rng.randint(0, 80), None])
+    if rng.random() < 0.9:
+      c["popularity"] = rng.choice([None, 0, rng.uniform(0, 5)])
+    cast.append(c)
+  assert select_cast(cast)["main"] == old_main_cast(cast)
+
+def test_many_movies_in_one_pass():
+  out = select_many(TRICKY)
+  for name, cast in TRICKY.items():
+    assert out[name]["main"] == old_main_cast(cast)
+    assert len(out[name]["full"]) == len(cast)
+    assert len(out[name]["main"]) + len(out[name]["excluded"]) == len(cast)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from gallery import UNKNOWN, EmbeddingIndex, normalize
+
+def gallery(seed, n=300, d=16, classes=6):
+  rng = np.random.default_rng(seed)
+  centres = normalize(rng.normal(size=(classes, d)))
+  y = rng.integers(0, classes, n)
+  X = normalize(centres[y] + rng.normal(scale=0.4, size=(n, d)))
+  return X, np.array([f"role{c}" for c in y]), rng
+
+# the search and calibration the chunked versions replace, all in one matrix
+def brute_search(X, E, k):
+  S = normalize(E) @ X.T
+  idx = np.argsort(-S, axis=1, kind="stable")[:, :k]
+  return np.take_along_axis(S, idx, axis=1), idx
+
+def brute_calibrate(X, y):
+  S = X @ X.T
+  np.fill_diagonal(S, -np.inf)
+  same = y[:, None] == y[None]
+  genuine = np.where(same, S, -np.inf).max(axis=1)
+  impostor = np.where(same, -np.inf, S).max(axis=1)
+  genuine = genuine[np.isfinite(genuine)]
+  cuts = np.unique(np.concatenate([genuine, impostor]))
+  errors = [(genuine < c).sum() + (impostor >= c).sum() for c in cuts]
+  return float(cuts[int(np.argmin(errors))])
+
+@pytest.mark.parametrize("chunk", [1, 7, 64, 4096])
+@pytest.mark.parametrize("k", [1, 5, 12])
+def test_chunked_search_matches_brute_force(chunk, k):
+  X, y, rng = gallery(chunk + k)
+  E = rng.normal(size=(25, X.shape[1]))
+  index = EmbeddingIndex(k=k, threshold=0.0, chunk=chunk).fit(X, y)
+  sims, idx = index.search(E, k)
+  want_sims, want_idx = brute_search(X, E, k)
+  np.testing.assert_allclose(sims, want_sims, atol=1e-5)
+  # ties aside, the same gallery rows in the same order
+  np.testing.assert_allclose(np.take_along_axis(normalize(E) @ X.T, idx, axis=1), want_sims, atol=1e-5)
+
+def test_k_beyond_the_gallery():
+  X, y, rng = gallery(1, n=4)
+  sims, idx = EmbeddingIndex(threshold=0.0, chunk=3).fit(X, y).search(rng.normal(size=(2, X.shape[1])), 10)
+  assert idx.shape == (2, 4) and sorted(idx[0]) == [0, 1, 2, 3]
+
+@pytest.mark.parametrize("chunk", [1, 13, 4096])
+def test_chunked_calibrate_matches_brute_force(chunk):
+  X, y, _ = gallery(chunk, n=120)
+  assert EmbeddingIndex(chunk=chunk).fit(X, y).threshold == pytest.approx(brute_calibrate(X, y), abs=1e-6)
+
+def test_below_threshold_is_unknown():
+  X, y, rng = gallery(2)
+  index = EmbeddingIndex(k=1, threshold=0.999).fit(X, y)
+  # gallery members match themselves at 1.0, a fresh direction matches nothing that well
+  assert index.predict(X[:10]).tolist() == y[:10].tolist()
+  assert index.predict(rng.normal(size=(3, X.shape[1]))).tolist() == [UNKNOWN] * 3
+
+def test_float16_gallery_matches_float32():
+  X, y, rng = gallery(3)
+  E = rng.normal(size=(20, X.shape[1]))
+  index = EmbeddingIndex(threshold=0.0, chunk=32).fit(X, y)
+  want = index.predict(E)
+  index.attach(X.astype(np.float16))
+  assert index.predict(E).tolist() == want.tolist()
@@ -0,0 +1,72 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from image_filter import dedup_embeddings, filter_images, inspect_file
+
+def texture(seed, h=300, w=400):
+  rng = np.random.default_rng(seed)
+  return cv2.resize(rng.integers(0, 255, (12, 16, 3)).astype(np.uint8), (w, h), interpolation=cv2.INTER_CUBIC)
+
+def save(path, img):
+  cv2.imwrite(str(path), img)
+  return str(path)
+
+# the pairwise loop the hash matrix replaced: largest first, a file is a
+# duplicate when some kept file is within max_distance bits on both hashes
+def old_filter(paths, max_distance=6):
+  found = [(p, inspect_file(p)) for p in paths]
+  candidates = sorted([(p, h) for p, (r, h) in found if r is None], key=lambda c: -c[1][2])
+  kept = []
+  for p, h in candidates:
+    if not any(bin(h[0] ^ k[0]).count("1") <= max_distance and bin(h[1] ^ k[1]).count("1") <= max_distance
+               for _, k in kept):
+      kept.append((p, h))
+  keep = {p for p, _ in kept}
+  return [p for p in paths if p in keep]
+
+def test_junk_is_rejected_with_its_reason(tmp_path):
+  good = save(tmp_path / "good.png", texture(0))
+  tiny = save(tmp_path / "tiny.png", texture(1, 40, 40))
+  banner = save(tmp_path / "banner.png", texture(2, 80, 600))
+  flat = save(tmp_path / "flat.png", np.random.default_rng(3).integers(126, 130, (300, 300, 3)).astype(np.uint8))
+  broken = str(tmp_path / "broken.jpg")
+  with open(broken, "wb") as fh:
+    fh.write(os.urandom(4096))
+  keep, rejected = filter_images([good, tiny, banner, flat, broken])
+  assert keep == [good]
+  assert rejected == {tiny: "too_small", banner: "odd_shape", flat: "blank", broken: "undecodable"}
+
+def test_largest_copy_of_a_shot_is_kept(tmp_path):
+  shot = texture(4, 600, 800)
+  paths = [save(tmp_path / f"{w}.jpg", cv2.resize(shot, (w, w * 3 // 4))) for w in (300, 800, 500)]
+  other = save(tmp_path / "other.jpg", texture(5, 600, 800))
+  keep, rejected = filter_images(paths + [other])
+  assert keep == [paths[1], other]
+  assert rejected == {paths[0]: "duplicate", paths[2]: "duplicate"}
+
+@pytest.mark.parametrize("max_distance", [0, 6, 16])
+def test_matches_pairwise_loop(tmp_path, max_distance):
+  rng = np.random.default_rng(max_distance)
+  paths = []
+  for i in range(30):
+    # a few base shots, each copy resized, brightened or lightly marked
+    img = texture(i % 6, 300, 400).astype(np.int16) + rng.integers(-30, 30)
+    img[rng.integers(0, 250):, rng.integers(0, 350):][:20, :20] = rng.integers(0, 255)
+    img = cv2.resize(np.clip(img, 0, 255).astype(np.uint8), None, fx=rng.uniform(0.5, 1.0), fy=rng.uniform(0.5, 1.0))
+    paths.append(save(tmp_path / f"{i}.png", img))
+  keep, rejected = filter_images(paths, max_distance)
+  assert keep == old_filter(paths, max_distance)
+  assert set(keep) | set(rejected) == set(paths)
+
+def test_dedup_embeddings_matches_loop():
+  rng = np.random.default_rng(0)
+  X = rng.normal(size=(40, 8))
+  X = np.repeat(X, 3, axis=0) + rng.normal(scale=0.05, size=(120, 8))
+  X /= np.linalg.norm(X, axis=1, keepdims=True)
+  kept = []
+  for i, x in enumerate(X):
+    if all(x @ X[j] < 0.97 for j in kept):
+      kept.append(i)
+  assert np.flatnonzero(dedup_embeddings(X, 0.97)).tolist() == kept
+  assert dedup_embeddings(np.zeros((0, 8))).shape == (0,)
@@ -0,0 +1,41 @@
+import asyncio, os
+import cv2
+import numpy as np
+from scrape import scrape_cast
+
+JPEG = cv2.imencode(".jpg", np.random.default_rng(0).integers(0, 255, (96, 96, 3), np.uint8))[1].tobytes()
+
+# the stub server (conftest.py) as the image search and the hosts its hits point at
+def image_search(hits):
+  def respond(path, params):
+    if path == "/search.json":
+      return 200, {"images_results": [{"original": u} for u in hits]}, {}
+    if path == "/ok.jpg":
+      return 200, JPEG, {"Content-Type": "image/jpeg"}
+    if path == "/loop":
+      return 302, b"", {"Location": "/loop"}
+    if path == "/gzip":
+      return 200, b"not gzip at all", {"Content-Encoding": "gzip"}
+    if path == "/text":
+      return 200, b"<html>hello</html>" * 10, {"Content-Type": "text/html"}
+    return 404, b"", {}
+  return respond
+
+def scrape(server, tmp_path, hits):
+  server.respond = image_search(hits)
+  return asyncio.run(scrape_cast({"Actor": "Role"}, "Movie", str(tmp_path), "key",
+                                 search_url=server.url + "/search.json", retries=1))["Role"]
+
+def test_good_hits_are_kept(server, tmp_path):
+  result = scrape(server, tmp_path, [server.url + "/ok.jpg", server.url + "/ok.jpg"])
+  assert result == {"downloaded": 2, "failed": 0, "invalid": 0}
+  assert sorted(os.listdir(tmp_path / "Role")) == ["1.jpg", "2.jpg"]
+
+def test_bad_hits_are_counted_not_raised(server, tmp_path):
+  # redirect loop (TooManyRedirects), bad gzip (DecodingError), malformed url
+  # (InvalidURL), a 404, and a page that isn't an image
+  hits = [server.url + "/ok.jpg", server.url + "/loop", server.url + "/gzip", "http://host:port/x.jpg",
+          server.url + "/missing.jpg", server.url + "/text"]
+  result = scrape(server, tmp_path, hits)
+  assert result == {"downloaded": 1, "failed": 4, "invalid": 1}
+  assert os.listdir(tmp_path / "Role") == ["1.jpg"]
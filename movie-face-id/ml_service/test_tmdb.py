@@ -0,0 +1,72 @@
+import asyncio, time
+import httpx
+import pytest
+from tmdb import Offline, Tmdb
+
+CAST = [{"name": f"Actor {i}", "character": f"Role {i}", "order": i, "popularity": 5.0} for i in range(8)]
+
+# the stub server (conftest.py) answering as the TMDB API would
+def tmdb_api(status=200, delay=0.0):
+  def respond(path, params):
+    time.sleep(delay)
+    if path == "/search/movie":
+      body = {"results": [{"id": 1, "title": params.get("query")}]}
+    elif path.startswith("/movie/") and path.endswith("/credits"):
+      body = {"cast": CAST}
+    else:
+      return 404, {}, {}
+    return status, body if status == 200 else {}, {}
+  return respond
+
+@pytest.fixture
+def api(server):
+  server.respond = tmdb_api()
+  return server
+
+def run(tmdb, calls):
+  async def main():
+    try:
+      return await calls(tmdb)
+    finally:
+      await tmdb.aclose()
+  return asyncio.run(main())
+
+def test_fresh_answers_come_from_the_cache(api, tmp_path):
+  cache = str(tmp_path / "tmdb.sqlite")
+  first = run(Tmdb("key", cache, api.url), lambda t: t.search("  Heat "))
+  # a new client on the same file, as after a restart
+  second = run(Tmdb("other", cache, api.url), lambda t: t.search("Heat"))
+  assert first == second == [{"id": 1, "title": "Heat"}]
+  assert api.requests == [("/search/movie", {"query": "Heat", "api_key": "key"})]
+
+def test_concurrent_lookups_share_one_request(api, tmp_path):
+  api.respond = tmdb_api(delay=0.2)
+  tmdb = Tmdb("key", str(tmp_path / "tmdb.sqlite"), api.url)
+  results = run(tmdb, lambda t: asyncio.gather(*(t.credits(603) for _ in range(5))))
+  assert results == [CAST] * 5
+  assert len(api.requests) == 1
+
+def test_stale_answer_is_served_when_tmdb_fails(api, tmp_path):
+  cache = str(tmp_path / "tmdb.sqlite")
+  run(Tmdb("key", cache, api.url), lambda t: t.credits(603))
+  api.respond = tmdb_api(status=503)
+  stale = Tmdb("key", cache, api.url, credits_ttl=0)
+  assert run(stale, lambda t: t.credits(603)) == CAST
+  assert len(api.requests) == 2
+  with pytest.raises(httpx.HTTPStatusError):
+    run(Tmdb("key", cache, api.url), lambda t: t.credits(604))
+
+def test_offline_never_calls_tmdb(api, tmp_path):
+  cache = str(tmp_path / "tmdb.sqlite")
+  run(Tmdb("key", cache, api.url), lambda t: t.search("Heat"))
+  offline = Tmdb("key", cache, api.url, offline=True, search_ttl=0)
+  assert run(offline, lambda t: t.search("Heat")) == [{"id": 1, "title": "Heat"}]
+  with pytest.raises(Offline):
+    run(Tmdb("key", cache, api.url, offline=True), lambda t: t.search("Ronin"))
+  assert len(api.requests) == 1
+
+def test_cast_selects_from_cached_credits(api, tmp_path):
+  tmdb = Tmdb("key", str(tmp_path / "tmdb.sqlite"), api.url)
+  res = run(tmdb, lambda t: t.cast(603, api_key="gateway"))
+  assert res["main"] == {c["name"]: c["character"] for c in CAST[:5]}
+  assert api.requests == [("/movie/603/credits", {"api_key": "gateway"})]
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+import argparse, asyncio, json, os, sqlite3, sys, threading, time
+import httpx
+from cast import select_cast
+
+TMDB_URL = "https://api.themoviedb.org/3"
+SEARCH_TTL = 24 * 3600
+CREDITS_TTL = 7 * 24 * 3600
+
+class Offline(Exception):
+  pass
+
+# cache key of a TMDB request: path and params, never the api key
+def cache_key(path, params):
+  return path + "?" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+# TMDB responses by cache_key in SQLite, with
+# the most recently used bodies also kept parsed in memory
+class ResponseCache:
+  def __init__(self, path, memory=256):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, fetched REAL, body TEXT)")
+    self.db.commit()
+    self.memory = OrderedDict()
+    self.max_memory = memory
+    self.lock = threading.Lock()
+
+  # (fetched timestamp, parsed body) or None
+  def get(self, key):
+    with self.lock:
+      if key in self.memory:
+        self.memory.move_to_end(key)
+        return self.memory[key]
+      row = self.db.execute("SELECT fetched, body FROM responses WHERE key = ?", (key,)).fetchone()
+      if row is None:
+        return None
+      entry = (row[0], json.loads(row[1]))
+      self._remember(key, entry)
+      return entry
+
+  def put(self, key, body):
+    entry = (time.time(), body)
+    with self.lock:
+      self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, entry[0], json.dumps(body)))
+      self.db.commit()
+      self._remember(key, entry)
+
+  def _remember(self, key, entry):
+    self.memory[key] = entry
+    self.memory.move_to_end(key)
+    while len(self.memory) > self.max_memory:
+      self.memory.popitem(last=False)
+
+# TMDB client for movie search and credits. fresh cached answers are served
+# without a request, concurrent lookups of the same key share one request, and
+# when TMDB can't be reached (or offline=True) whatever is cached is served
+# however old; Offline is raised only when there is nothing cached at all
+class Tmdb:
+  def __init__(self, api_key, cache_path, base_url=TMDB_URL, offline=False, timeout=10.0,
+               search_ttl=SEARCH_TTL, credits_ttl=CREDITS_TTL):
+    self.api_key = api_key
+    self.cache = ResponseCache(cache_path)
+    self.base_url = base_url.rstrip("/")
+    self.offline = offline
+    self.timeout = timeout
+    self.ttl = {"search": search_ttl, "credits": credits_ttl}
+    self.inflight = {}
+    self.client = None
+
+  async def aclose(self):
+    if self.client is not None:
+      await self.client.aclose()
+
+  # api_key overrides the client's own key for this call (the gateway passes its key)
+  async def fetch(self, kind, path, params, api_key=None):
+    key = cache_key(path, params)
+    cached = self.cache.get(key)
+    if cached is not None and (self.offline or time.time() - cached[0] < self.ttl[kind]):
+      return cached[1]
+    if self.offline:
+      raise Offline(f"{key} is not cached")
+    if key not in self.inflight:
+      self.inflight[key] = asyncio.ensure_future(self.request(key, path, params, api_key or self.api_key))
+      self.inflight[key].add_done_callback(lambda _: self.inflight.pop(key, None))
+    try:
+      return await asyncio.shield(self.inflight[key])
+    except (httpx.HTTPError, ValueError):
+      if cached is not None:
+        return cached[1]
+      raise
+
+  async def request(self, key, path, params, api_key):
+    if self.client is None:
+      self.client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout))
+    r = await self.client.get(self.base_url + path, params={**params, "api_key": api_key})
+    r.raise_for_status()
+    body = r.json()
+    await asyncio.to_thread(self.cache.put, key, body)
+    return body
+
+  async def search(self, query, api_key=None):
+    body = await self.fetch("search", "/search/movie", {"query": query.strip()}, api_key)
+    return body.get("results", [])
+
+  async def credits(self, movie_id, api_key=None):
+    body = await self.fetch("credits", f"/movie/{int(movie_id)}/credits", {}, api_key)
+    return body.get("cast", [])
+
+  # {"main": {actor: role}, "full": [...]} as /api/credits has always returned
+  # it, plus "excluded": the rows left out, each with its reason
+  async def cast(self, movie_id, api_key=None):
+    return select_cast(await self.credits(movie_id, api_key))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="look movies and casts up through the local TMDB cache")
+  parser.add_argument("what", choices=["search", "credits"])
+  parser.add_argument("arg", help="search text or TMDB movie id")
+  parser.add_argument("--cache", default=os.path.join(os.path.dirname(__file__), "models", "tmdb.sqlite"))
+  parser.add_argument("--api-key", default=os.environ.get("TMDB_API_KEY", ""))
+  parser.add_argument("--base-url", default=os.environ.get("TMDB_URL", TMDB_URL))
+  parser.add_argument("--offline", action="store_true", help="never call TMDB, answer from the cache only")
+  args = parser.parse_args()
+
+  async def main():
+    tmdb = Tmdb(args.api_key, args.cache, args.base_url, args.offline)
+    try:
+      if args.what == "search":
+        return await tmdb.search(args.arg)
+      return await tmdb.cast(args.arg)
+    finally:
+      await tmdb.aclose()
+  try:
+    print(json.dumps(asyncio.run(main()), indent=2))
+  except Offline as e:
+    sys.exit(f"offline: {e}")
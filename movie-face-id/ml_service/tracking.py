@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+from face_pipeline import detect, align, embed_crops
+
+def iou(a, b):
+  x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+  x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+  inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+  union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - inter
+  return inter / union if union > 0 else 0.0
+
+class Track:
+  def __init__(self, track_id, box, redetect):
+    self.id = track_id
+    self.box = np.asarray(box, np.float32)
+    self.name = None
+    self.embedded_at = redetect
+    self.pts = None
+
+# carries face identities across frames. the full detector only runs every
+# detect_every frames (or as soon as a track is lost or the shot cuts); in
+# between, boxes are moved with sparse optical flow. a detection that overlaps
+# a track is embedded again only every reembed_every re-detections (1 = at
+# each one), so with a larger value a matched track keeps its name for longer.
+# a scene cut (the grey histogram stops correlating with the previous frame's)
+# drops every track, so whoever is on screen after the cut is identified anew
+class FaceTracker:
+  def __init__(self, classify, detect_every=5, iou_thresh=0.4, reembed_every=1, min_points=4, cut_thresh=0.5):
+    self.classify = classify
+    self.detect_every = detect_every
+    self.iou_thresh = iou_thresh
+    self.reembed_every = reembed_every
+    self.min_points = min_points
+    self.cut_thresh = cut_thresh
+    self.tracks = []
+    self.frame = 0
+    self.redetects = 0
+    self.next_id = 0
+    self.prev_gray = None
+    self.prev_hist = None
+    self.stats = {"frames": 0, "detections": 0, "embeddings": 0, "cuts": 0}
+
+  def update(self, img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    cut = self.scene_cut(gray)
+    if cut:
+      self.tracks = []
+      self.stats["cuts"] += 1
+    lost = self.prev_gray is not None and not self.propagate(gray)
+    if cut or lost or self.frame % self.detect_every == 0:
+      self.redetect(img, gray)
+    self.prev_gray = gray
+    self.frame += 1
+    self.stats["frames"] += 1
+    return [(t.id, t.name, t.box.astype(int).tolist()) for t in self.tracks]
+
+  def scene_cut(self, gray):
+    hist = cv2.calcHist([gray], [0], None, [32], [0, 256])
+    cv2.normalize(hist, hist)
+    prev, self.prev_hist = self.prev_hist, hist
+    return prev is not None and cv2.compareHist(prev, hist, cv2.HISTCMP_CORREL) < self.cut_thresh
+
+  def seed_points(self, gray, track):
+    x1, y1, x2, y2 = track.box.astype(int)
+    mask = np.zeros_like(gray)
+    mask[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)] = 255
+    track.pts = cv2.goodFeaturesToTrack(gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+
+  # shift every box by the median motion of its points, False if any track was lost
+  def propagate(self, gray):
+    ok = True
+    for t in self.tracks:
+      if t.pts is None or len(t.pts) < self.min_points:
+        ok = False
+        continue
+      nxt, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, t.pts, None)
+      good = status.reshape(-1) == 1
+      if good.sum() < self.min_points:
+        t.pts = None
+        ok = False
+        continue
+      shift = np.median(nxt[good] - t.pts[good], axis=0).reshape(-1)
+      t.box += np.array([shift[0], shift[1], shift[0], shift[1]], np.float32)
+      t.pts = nxt[good].reshape(-1, 1, 2)
+    return ok
+
+  def redetect(self, img, gray):
+    boxes, _, kpss = detect(img)
+    self.stats["detections"] += 1
+    # greedy IoU matching, best overlaps first
+    pairs = sorted(((iou(t.box, b), ti, bi) for ti, t in enumerate(self.tracks) for bi, b in enumerate(boxes)), reverse=True)
+    matched_t, matched_b, tracks = set(), {}, []
+    for score, ti, bi in pairs:
+      if score < self.iou_thresh: break
+      if ti in matched_t or bi in matched_b: continue
+      matched_t.add(ti)
+      matched_b[bi] = self.tracks[ti]
+    to_embed = []
+    for bi, b in enumerate(boxes):
+      t = matched_b.get(bi)
+      if t is None:
+        t = Track(self.next_id, b, self.redetects)
+        self.next_id += 1
+      t.box = np.asarray(b, np.float32)
+      if t.name is None or self.redetects - t.embedded_at >= self.reembed_every:
+        to_embed.append((t, kpss[bi]))
+      self.seed_points(gray, t)
+      tracks.append(t)
+    if to_embed:
+      names = self.classify(embed_crops(align(img, [k for _, k in to_embed])))
+      for (t, _), name in zip(to_embed, names):
+        t.name = str(name)
+        t.embedded_at = self.redetects
+      self.stats["embeddings"] += len(to_embed)
+    self.tracks = tracks
+    self.redetects += 1
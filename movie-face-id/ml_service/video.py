@@ -0,0 +1,151 @@
+import argparse, json, os, queue, sys, threading, time
+import cv2
+import face_pipeline
+from face_pipeline import detect_and_embed
+from profiles import PREDICT_PROFILE, PROFILES
+from tracking import FaceTracker
+from gallery import UNKNOWN
+from registry import ModelRegistry, load_model
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "clf.joblib")
+
+# producer: decodes the video and hands every stride-th frame to the consumer.
+# grab() skips the colour conversion for frames we are not going to look at
+def read_frames(cap, fps, stride, frames, stop):
+  idx = 0
+  while not stop.is_set():
+    if not cap.grab():
+      break
+    if idx % stride == 0:
+      ok, img = cap.retrieve()
+      if ok:
+        frames.put((idx / fps, img))
+    idx += 1
+  frames.put(None)
+
+# merges per-frame sightings into [start, end] ranges per character, a range is
+# closed once the character has been missing for longer than max_gap seconds
+class Timeline:
+  def __init__(self, out, max_gap):
+    self.out = out
+    self.max_gap = max_gap
+    self.open = {}
+
+  def add(self, t, name, box):
+    if name == UNKNOWN:
+      return
+    seg = self.open.get(name)
+    if seg is not None and t - seg["end"] > self.max_gap:
+      self.emit(name)
+      seg = None
+    if seg is None:
+      seg = self.open[name] = {"name": name, "start": t, "end": t, "boxes": []}
+    seg["end"] = t
+    seg["boxes"].append({"t": round(t, 3), "box": box})
+
+  def tick(self, t):
+    for name in [n for n, s in self.open.items() if t - s["end"] > self.max_gap]:
+      self.emit(name)
+
+  def emit(self, name):
+    seg = self.open.pop(name)
+    seg["start"], seg["end"] = round(seg["start"], 3), round(seg["end"], 3)
+    self.out.write(json.dumps(seg) + "\n")
+    self.out.flush()
+
+  def close(self):
+    for name in list(self.open):
+      self.emit(name)
+
+def scan(video_path, out, clf, sample_fps=2.0, batch=8, max_gap=None, detect_every=1, reembed_every=1):
+  cap = cv2.VideoCapture(video_path)
+  if not cap.isOpened():
+    raise FileNotFoundError(f"could not open video: {video_path}")
+  fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+  stride = max(1, round(fps / sample_fps))
+  timeline = Timeline(out, max_gap if max_gap is not None else 2.5 * stride / fps)
+
+  frames, stop = queue.Queue(maxsize=4 * batch), threading.Event()
+  producer = threading.Thread(target=read_frames, args=(cap, fps, stride, frames, stop), daemon=True)
+  producer.start()
+
+  classify = clf.predict
+  tracker = FaceTracker(classify, detect_every, reembed_every=reembed_every) if detect_every > 1 else None
+
+  started, last_t, done = time.time(), 0.0, False
+  try:
+    while tracker is not None and not done:
+      # tracking needs every sampled frame in order, one at a time
+      item = frames.get()
+      if item is None:
+        done = True
+        continue
+      t, img = item
+      for _, name, box in tracker.update(img):
+        timeline.add(t, name, box)
+      timeline.tick(t)
+      last_t = t
+    while not done:
+      # take whatever is ready (up to batch frames) so one recognition pass covers them all
+      chunk = [frames.get()]
+      while len(chunk) < batch and chunk[-1] is not None:
+        try:
+          chunk.append(frames.get_nowait())
+        except queue.Empty:
+          break
+      if chunk[-1] is None:
+        done = True
+        chunk.pop()
+      if not chunk:
+        continue
+      boxes, embeddings = detect_and_embed([img for _, img in chunk])
+      names = classify(embeddings) if len(embeddings) else []
+      i = 0
+      for (t, _), b in zip(chunk, boxes):
+        for x1,y1,x2,y2 in b.astype(int).tolist():
+          timeline.add(t, str(names[i]), [x1,y1,x2,y2])
+          i += 1
+        timeline.tick(t)
+        last_t = t
+  finally:
+    stop.set()
+    while producer.is_alive():
+      try:
+        frames.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    timeline.close()
+    cap.release()
+  elapsed = time.time() - started
+  return {"video_seconds": last_t, "wall_seconds": elapsed,
+          "realtime_factor": last_t / elapsed if elapsed > 0 else None}
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="scan a video file and write a character timeline as JSONL")
+  parser.add_argument("video")
+  parser.add_argument("--out", default="-", help="output .jsonl path, - for stdout")
+  parser.add_argument("--model", default=MODEL_PATH)
+  parser.add_argument("--movie-id", type=int, default=None, help="use the model trained for this TMDB id")
+  parser.add_argument("--sample-fps", type=float, default=2.0, help="frames per second of video to analyse")
+  parser.add_argument("--batch", type=int, default=8, help="frames per recognition pass")
+  parser.add_argument("--detect-every", type=int, default=1,
+                      help="run the face detector every K sampled frames and track boxes in between (1 = no tracking)")
+  parser.add_argument("--reembed-every", type=int, default=1,
+                      help="with tracking, re-identify a tracked face every N detector runs (1 = each one)")
+  parser.add_argument("--max-gap", type=float, default=None, help="seconds a character may be missing before a range closes")
+  parser.add_argument("--profile", default=PREDICT_PROFILE, choices=sorted(PROFILES), help="detector size/threshold profile")
+  args = parser.parse_args()
+
+  if args.movie_id is not None:
+    args.model = ModelRegistry(os.path.dirname(__file__), 0).model_path(args.movie_id)
+  clf = load_model(args.model)
+  # frames are processed on this thread, so it gets a FaceAnalysis with the chosen profile
+  face_pipeline.local.face_app = face_pipeline.build_face_app(profile=args.profile)
+  out = sys.stdout if args.out == "-" else open(args.out, "w")
+  try:
+    stats = scan(args.video, out, clf, args.sample_fps, args.batch, args.max_gap, args.detect_every, args.reembed_every)
+  finally:
+    if out is not sys.stdout:
+      out.close()
+  print(f"scanned {stats['video_seconds']:.1f}s of video in {stats['wall_seconds']:.1f}s "
+        f"({stats['realtime_factor'] or 0:.1f}x realtime)", file=sys.stderr)